@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+classify_benchmark: per-edge cost of adding edges to a Graph, which
+normalizes names and labels, infers node MIME types and classifies
+edge labels, without the cost of reading a .dot file.
+
+Simeon Warner, 2015
+"""
+
+import logging
+import optparse
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from graphserver.graph import Graph
+from generate_graph import FANOUTS, generate_edges
+
+def make_edges(edges, fanout='uniform', seed=1):
+    """Return list of (src, dst, label) as read from a .dot file"""
+    return(list(generate_edges(edges, fanout=fanout, seed=seed)))
+
+def best_of(repeat, func):
+    """Return shortest time in seconds of repeat calls of func"""
+    best = None
+    for j in xrange(repeat):
+        start = time.time()
+        func()
+        t = time.time() - start
+        if (best is None or t < best):
+            best = t
+    return(best)
+
+def main():
+    p = optparse.OptionParser(description='Benchmark per-edge cost of Graph.add_edge()',
+                              usage='usage: %prog [options] (-h for help)')
+    p.add_option('--edges', '-e', action='store', default='10000,100000,1000000',
+                 help='comma separated list of numbers of edges (default %default)')
+    p.add_option('--fanout', '-f', action='store', default='uniform',
+                 help='fan-out distribution of the generated graphs, one of %s (default %%default)' %
+                      (', '.join(FANOUTS)))
+    p.add_option('--repeat', '-r', action='store', type=int, default=3,
+                 help='number of runs for each size, best is reported (default %default)')
+    (args, extra) = p.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    print "%10s %12s %12s %12s" % ('edges', 'add_edge us', 'label us', 'name us')
+    for num in [int(e) for e in args.edges.split(',')]:
+        edges = make_edges(num, args.fanout)
+        def add_edges():
+            g = Graph()
+            for (src, dst, label) in edges:
+                g.add_edge(src, dst, label)
+        # Label normalization and classification only, nodes already added
+        g = Graph()
+        for (src, dst, label) in edges:
+            g.add_edge(src, dst, label)
+        def classify():
+            for (src, dst, label) in edges:
+                g.add_edge(src, dst, label)
+        def names():
+            for (src, dst, label) in edges:
+                g.normalize_name(src)
+        us = 1000000.0 / num
+        print "%10d %12.2f %12.2f %12.2f" % (num, best_of(args.repeat, add_edges) * us,
+                                            best_of(args.repeat, classify) * us,
+                                            best_of(args.repeat, names) * us)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+compress_benchmark: size of the responses compiled for generated
+graphs with and without precompressed variants, the extra compile
+time, and the throughput of the compression used.
+
+Simeon Warner, 2015
+"""
+
+import logging
+import optparse
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from graphserver.graph import Graph
+from graphserver.response_cache import (ResponseCache, brotli, gzip_chunks,
+                                        gzip_stream, gunzip_chunks)
+from generate_graph import FANOUTS, write_graph
+
+def all_responses(cache):
+    """Generator of every compiled Response in cache"""
+    for response in cache.responses.values():
+        yield response
+    for resource in cache.conneg.values():
+        for response in resource.variants.values():
+            yield response
+
+def compile_cache(graph, compress=True):
+    """Return (seconds, ResponseCache) to compile responses for graph"""
+    cache = ResponseCache({graph.name: graph})
+    if (not compress):
+        cache.compress_min_size = sys.maxint
+    start = time.time()
+    cache.compile(static_files=())
+    return((time.time() - start, cache))
+
+def sizes(cache):
+    """Return dict of total content bytes by encoding
+
+    For each encoding the total is of the variant a client accepting
+    only that encoding would get, the identity response if there is
+    no compressed variant. Only responses with content of a type that
+    may be compressed are counted, not the PDF and image assets.
+    """
+    totals = dict((e, 0) for e in ('identity',) + cache.encodings)
+    for response in all_responses(cache):
+        if (not dict(response.headers).get('Content-Type', '').startswith(cache.compress_types)):
+            continue
+        totals['identity'] += response.length
+        for encoding in cache.encodings:
+            variant = (response.encoded or {}).get(encoding, response)
+            totals[encoding] += variant.length
+    return(totals)
+
+def throughput(func, data, repeat=3):
+    """Return best MB/s of repeat calls of func on data"""
+    best = None
+    for j in xrange(repeat):
+        start = time.time()
+        func(data)
+        t = time.time() - start
+        if (best is None or t < best):
+            best = t
+    return(len(data) / (1024.0 * 1024.0) / max(best, 1e-6))
+
+def main():
+    p = optparse.OptionParser(description='Benchmark precompressed response variants',
+                              usage='usage: %prog [options] (-h for help)')
+    p.add_option('--edges', '-e', action='store', default='1000,10000,100000',
+                 help='comma separated list of graph sizes in edges (default %default)')
+    p.add_option('--fanout', '-f', action='store', default='uniform',
+                 help='fan-out distribution of the generated graphs, one of %s (default %%default)' %
+                      (', '.join(FANOUTS)))
+    (args, extra) = p.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    tmpdir = tempfile.mkdtemp(prefix='compress_benchmark')
+    print "%10s %10s %12s %12s %12s %12s %12s" % ('edges', 'responses', 'identity MB', 'gzip MB',
+                                                  'br MB', 'compile s', 'w/gzip s')
+    for edges in [int(e) for e in args.edges.split(',')]:
+        file = os.path.join(tmpdir, 'bench_%d.dot' % (edges))
+        write_graph(file, edges, fanout=args.fanout)
+        g = Graph()
+        g.parse(file)
+        os.remove(file)
+        (plain_seconds, cache) = compile_cache(g, compress=False)
+        (seconds, cache) = compile_cache(g)
+        totals = sizes(cache)
+        mb = 1024.0 * 1024.0
+        print "%10d %10d %12.2f %12.2f %12s %12.2f %12.2f" % (
+            edges, len(list(all_responses(cache))), totals['identity'] / mb, totals['gzip'] / mb,
+            ('%.2f' % (totals['br'] / mb)) if ('br' in totals) else '-', plain_seconds, seconds)
+    os.rmdir(tmpdir)
+
+    # Throughput on the content of one large page, the index of the last graph
+    page = cache.renderer.graph_index_page(g)
+    gzipped = gzip_chunks([page])
+    print
+    print "%-28s %10s" % ('compression of %.1fMB page' % (len(page) / mb), 'MB/s')
+    print "%-28s %10.1f" % ('gzip level 9 (precompressed)', throughput(lambda d: gzip_chunks([d]), page))
+    print "%-28s %10.1f" % ('gzip level 6 (streamed)', throughput(lambda d: ''.join(gzip_stream([d])), page))
+    print "%-28s %10.1f" % ('gunzip', throughput(lambda d: ''.join(gunzip_chunks(gzipped)), page))
+    if (brotli is not None):
+        print "%-28s %10.1f" % ('brotli', throughput(brotli.compress, page))
+
+if __name__ == '__main__':
+    main()
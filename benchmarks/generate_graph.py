@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+generate_graph: write large synthetic scenarios in the graphserver
+.dot format for benchmarks and stress tests.
+
+A generated graph is a set of articles, each following the pattern
+of the sample scenarios: a DOI that is a non-information resource
+with conneg to a Splash Page and RDF, a Splash Page with items PDF
+and HTML, and figures that are an image included in the HTML and a
+fragment of the Splash Page. Further edges, up to the number asked
+for, are links between articles (HTML links and typed and untyped
+HTTP Links) from sources chosen with a fan-out distribution:
+
+  uniform - each source chosen at random from all nodes
+  fixed   - sources taken in turn, so every node has the same fan-out
+  zipf    - source of rank k chosen with weight 1/k**s, a few hubs
+            with very many links and most nodes with few
+
+Simeon Warner, 2015
+"""
+
+import bisect
+import logging
+import optparse
+import os.path
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from graphserver.graph import Graph
+
+FANOUTS = ('uniform', 'fixed', 'zipf')
+
+# Labels of links between articles, by whether the source is HTML
+HTML_LABELS = ['"HTML\\nlink"', '"HTML\\nlink"', 'related', '"cite-as"',
+               '"alternate\\ntext/html"', '"HTML\\nimg"']
+LINK_LABELS = ['related', '"related\\ntext/html"', '"describedby\\ntext/turtle"',
+               '"cite-as"', '"item\\napplication/pdf"']
+
+def article_nodes(n, fragments=1):
+    """Return list of the quoted names of the nodes of article n"""
+    names = ['"DOI %d"' % n, '"Splash Page %d"' % n, '"PDF %d"' % n,
+             '"HTML %d"' % n, '"RDF %d"' % n]
+    for k in xrange(1, fragments + 1):
+        names.extend(['"IMG %d.%d"' % (n, k), '"Splash Page %d#fig%d"' % (n, k)])
+    return(names)
+
+def article_edges(n, fragments=1):
+    """Return list of (src, dst, label) of the edges of article n
+
+    The conneg edge to the Splash Page is first so that it is the
+    default.
+    """
+    (doi, splash, pdf, html, rdf) = article_nodes(n, 0)
+    edges = [(doi, splash, '"conneg 303\\ntext/html"'),
+             (doi, rdf, '"conneg 303\\ntext/turtle"'),
+             (doi, splash, '"describedby\\ntext/html"'),
+             (splash, doi, '"canonical,\\ndescribes"'),
+             (splash, pdf, '"item\\napplication/pdf"'),
+             (splash, html, '"item\\ntext/html"'),
+             (splash, pdf, '"HTML\\nlink"'),
+             (splash, html, '"HTML\\nlink"'),
+             (pdf, splash, 'collection'),
+             (html, splash, 'collection'),
+             (pdf, html, '"alternate\\ntext/html"'),
+             (html, pdf, '"alternate\\napplication/pdf"'),
+             (rdf, doi, 'describes')]
+    for k in xrange(1, fragments + 1):
+        img = '"IMG %d.%d"' % (n, k)
+        fig = '"Splash Page %d#fig%d"' % (n, k)
+        edges.extend([(html, img, '"HTML\\nimg"'),
+                      (fig, img, '"HTML\\nimg"'),
+                      (fig, doi, '"canonical,\\ndescribes"'),
+                      (img, fig, 'collection')])
+    return(edges)
+
+def source_chooser(num, fanout, r, zipf_exponent=1.0):
+    """Return function giving the next source node number in range(num)"""
+    if (fanout == 'uniform'):
+        return(lambda: r.randrange(num))
+    elif (fanout == 'fixed'):
+        state = [0]
+        def next_source():
+            state[0] += 1
+            return((state[0] - 1) % num)
+        return(next_source)
+    elif (fanout == 'zipf'):
+        # Ranks are assigned to the nodes in random order so that the
+        # hubs are not all at the start of the graph
+        order = range(num)
+        r.shuffle(order)
+        cumulative = []
+        total = 0.0
+        for k in xrange(num):
+            total += 1.0 / (k + 1) ** zipf_exponent
+            cumulative.append(total)
+        return(lambda: order[min(num - 1, bisect.bisect_left(cumulative, r.random() * total))])
+    raise ValueError("Unknown fan-out distribution %s, not one of %s" % (fanout, ', '.join(FANOUTS)))
+
+def num_articles(nodes, fragments=1):
+    """Return number of articles to give about nodes nodes"""
+    return(max(1, nodes / len(article_nodes(0, fragments))))
+
+def generate_edges(edges, nodes=None, fanout='uniform', fragments=1, seed=1, zipf_exponent=1.0):
+    """Generator of (src, dst, label) for a graph of about nodes nodes
+
+    The number of nodes defaults to edges / 4. The edges of the
+    articles are generated first, then links between articles up to a
+    total of edges. If the articles alone have more edges than asked
+    for then there are no links between them.
+    """
+    r = random.Random(seed)
+    articles = num_articles(nodes if (nodes is not None) else edges / 4, fragments)
+    count = 0
+    for n in xrange(articles):
+        for edge in article_edges(n, fragments):
+            yield edge
+            count += 1
+    per_article = len(article_nodes(0, fragments))
+    next_source = source_chooser(articles * per_article, fanout, r, zipf_exponent)
+    for e in xrange(edges - count):
+        src = next_source()
+        (n, j) = divmod(src, per_article)
+        dst = r.randrange(articles * per_article)
+        if (articles > 1):
+            while (dst / per_article == n):
+                dst = r.randrange(articles * per_article)
+        src_name = article_nodes(n, fragments)[j]
+        labels = HTML_LABELS if ('Splash' in src_name or 'HTML' in src_name) else LINK_LABELS
+        yield((src_name, article_nodes(dst / per_article, fragments)[dst % per_article],
+               r.choice(labels)))
+
+def write_graph(file, edges, nodes=None, fanout='uniform', fragments=1, seed=1,
+                zipf_exponent=1.0, name='BENCH'):
+    """Write a digraph with about nodes nodes and edges edges to file
+
+    See generate_edges() for the arguments. Returns the number of
+    edges written.
+    """
+    count = 0
+    with open(file, 'w') as fh:
+        fh.write("digraph %s {\n" % (name))
+        for n in xrange(num_articles(nodes if (nodes is not None) else edges / 4, fragments)):
+            fh.write('  "DOI %d" [ style=filled ]\n' % (n))
+        for (src, dst, label) in generate_edges(edges, nodes, fanout, fragments, seed, zipf_exponent):
+            style = 'style=dashed ' if (label.startswith(('"conneg', '"HTML'))) else ''
+            fh.write('  %s -> %s [ %slabel=%s ]\n' % (src, dst, style, label))
+            count += 1
+        fh.write("}\n")
+    return(count)
+
+def main():
+    p = optparse.OptionParser(description='Write a synthetic graphserver scenario',
+                              usage='usage: %prog [options] file.dot (-h for help)')
+    p.add_option('--edges', '-e', action='store', type=int, default=10000,
+                 help='number of edges, at least those of the articles (default %default)')
+    p.add_option('--nodes', '-n', action='store', type=int,
+                 help='approximate number of nodes (default edges/4)')
+    p.add_option('--fanout', '-f', action='store', default='uniform',
+                 help='distribution of sources of links between articles, one of %s '
+                      '(default %%default)' % (', '.join(FANOUTS)))
+    p.add_option('--zipf-exponent', action='store', type=float, default=1.0,
+                 help='exponent s for zipf fan-out (default %default)')
+    p.add_option('--fragments', action='store', type=int, default=1,
+                 help='number of figures, each an image and a fragment node, per article (default %default)')
+    p.add_option('--seed', action='store', type=int, default=1,
+                 help='random seed (default %default)')
+    p.add_option('--name', action='store', default='BENCH',
+                 help='graph name, the first path component of its URIs (default %default)')
+    p.add_option('--check', action='store_true',
+                 help='parse the file written and report nodes, edges and fan-out')
+    (args, extra) = p.parse_args()
+    if (len(extra) != 1):
+        p.error("Expected one file name for the .dot file to write")
+    if (args.fanout not in FANOUTS):
+        p.error("Unknown --fanout %s, must be one of %s" % (args.fanout, ', '.join(FANOUTS)))
+
+    file = extra[0]
+    count = write_graph(file, args.edges, args.nodes, args.fanout, args.fragments,
+                        args.seed, args.zipf_exponent, args.name)
+    print "Wrote %d edges to %s" % (count, file)
+    if (args.check):
+        logging.basicConfig(level=logging.ERROR)
+        g = Graph()
+        g.parse(file, 'native')
+        fanout = sorted(len(g.out_edges(name)) for name in g.nodes)
+        print "Parsed %d nodes, %d with fragments, fan-out median %d max %d" % (
+            len(g.nodes), len(g.fragments), fanout[len(fanout) / 2], fanout[-1])
+
+if __name__ == '__main__':
+    main()
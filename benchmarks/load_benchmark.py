@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+load_benchmark: start graphserver on a set of scenarios and measure
+requests/s, latency percentiles and server memory under load.
+
+The scenarios are either the sample .dot files in the repository or
+generated graphs (--edges). For each set of scenarios and each server
+--mode a graphserver.py process is started and --concurrency client
+processes send GET and HEAD requests for random resources, with the
+Accept headers of --accept, for --duration seconds. Results may be
+written as JSON (--json) and compared with those of an earlier run
+(--compare).
+
+Simeon Warner, 2015
+"""
+
+import glob
+import httplib
+import json
+import logging
+import optparse
+import os
+import os.path
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BASE_DIR)
+from graphserver.graph import Graph
+from generate_graph import FANOUTS, write_graph
+
+DEFAULT_ACCEPTS = ['none', 'none', 'text/html', 'text/turtle',
+                   'text/turtle;q=0.5, text/html;q=0.9']
+
+def free_port():
+    """Return a port number that is free for the server to use"""
+    s = socket.socket()
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return(port)
+
+def resource_paths(dot_dir):
+    """Return list of paths of the resources of the scenarios in dot_dir
+
+    The graphs are parsed here with the same code as in the server, the
+    paths are the index, and the index, SVG and nodes of each graph.
+    """
+    paths = ['/']
+    for file in sorted(glob.glob(os.path.join(dot_dir, '*.dot'))):
+        g = Graph()
+        g.parse(file)
+        paths.append('/%s/' % (g.name))
+        if (g.svg):
+            paths.append('/%s/svg' % (g.name))
+        paths.extend('/%s/%s' % (g.name, n.replace('#', '%23')) for n in g.sorted_node_names())
+    return(paths)
+
+def start_server(dot_dir, mode, workers, timeout=600.0):
+    """Start graphserver.py on scenarios in dot_dir, return (process, port)
+
+    Waits until the server accepts connections, which is after all the
+    graphs have been parsed and compiled.
+    """
+    port = free_port()
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'graphserver.py'),
+                                 '-p', str(port), '-m', mode, '-w', str(workers), dot_dir],
+                                cwd=BASE_DIR, stdout=devnull, stderr=devnull)
+    deadline = time.time() + timeout
+    while (time.time() < deadline):
+        if (proc.poll() is not None):
+            raise Exception("graphserver.py exited with status %d" % (proc.returncode))
+        try:
+            socket.create_connection(('localhost', port), 1).close()
+            return((proc, port))
+        except socket.error:
+            time.sleep(0.2)
+    proc.kill()
+    raise Exception("graphserver.py did not start in %d seconds" % (timeout))
+
+def stop_server(proc):
+    """Stop server process, return its peak memory in MB"""
+    proc.terminate()
+    (pid, status, usage) = os.wait4(proc.pid, 0)
+    proc.returncode = status
+    # ru_maxrss is in KB on Linux, bytes on OS X
+    return(usage.ru_maxrss / (1024.0 * 1024.0) if (sys.platform == 'darwin') else usage.ru_maxrss / 1024.0)
+
+def client(port, paths, args, seed, deadline, out_file):
+    """Send requests until deadline, write latencies and status counts to out_file"""
+    r = random.Random(seed)
+    latencies = []
+    statuses = {}
+    errors = 0
+    conn = httplib.HTTPConnection('localhost', port, timeout=30)
+    while (time.time() < deadline):
+        path = r.choice(paths)
+        method = 'HEAD' if (r.random() < args.head) else 'GET'
+        headers = {}
+        accept = r.choice(args.accept)
+        if (accept != 'none'):
+            headers['Accept'] = accept
+        if (args.accept_encoding):
+            headers['Accept-Encoding'] = args.accept_encoding
+        if (args.close):
+            headers['Connection'] = 'close'
+        start = time.time()
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (httplib.HTTPException, socket.error):
+            errors += 1
+            conn.close()
+            continue
+        latencies.append(time.time() - start)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if (args.close):
+            conn.close()
+    conn.close()
+    with open(out_file, 'w') as fh:
+        json.dump({'latencies': latencies, 'statuses': statuses, 'errors': errors}, fh)
+
+def percentile(values, p):
+    """Return p-th percentile of sorted list values"""
+    if (not values):
+        return(None)
+    return(values[int(round(p / 100.0 * (len(values) - 1)))])
+
+def run_load(port, paths, args):
+    """Run args.concurrency clients against port, return dict of results"""
+    tmpdir = tempfile.mkdtemp(prefix='load_benchmark')
+    start = time.time()
+    deadline = start + args.duration
+    pids = []
+    for j in xrange(args.concurrency):
+        pid = os.fork()
+        if (pid == 0):
+            try:
+                client(port, paths, args, args.seed + j, deadline, os.path.join(tmpdir, '%d.json' % j))
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    seconds = time.time() - start
+    latencies = []
+    statuses = {}
+    errors = 0
+    for j in xrange(args.concurrency):
+        try:
+            with open(os.path.join(tmpdir, '%d.json' % j)) as fh:
+                data = json.load(fh)
+        except (IOError, ValueError):
+            errors += 1
+            continue
+        latencies.extend(data['latencies'])
+        errors += data['errors']
+        for (status, count) in data['statuses'].items():
+            statuses[status] = statuses.get(status, 0) + count
+    shutil.rmtree(tmpdir)
+    latencies.sort()
+    ms = lambda t: round(t * 1000.0, 3) if (t is not None) else None
+    return({'requests': len(latencies), 'errors': errors, 'seconds': round(seconds, 3),
+            'requests_per_second': round(len(latencies) / seconds, 1),
+            'latency_ms': dict([('p%d' % p, ms(percentile(latencies, p))) for p in (50, 90, 99)] +
+                               [('max', ms(latencies[-1] if latencies else None))]),
+            'statuses': statuses})
+
+def compare(results, previous):
+    """Print change of requests/s and latencies relative to previous results"""
+    old = dict(((r['scenarios'], r['mode']), r) for r in previous['results'])
+    print
+    print "%-20s %-8s %12s %12s %12s" % ('scenarios', 'mode', 'req/s', 'p50', 'p99')
+    for r in results:
+        o = old.get((r['scenarios'], r['mode']))
+        if (o is None):
+            continue
+        def change(new, old):
+            return('%+.1f%%' % (100.0 * (new - old) / old) if (new is not None and old) else '-')
+        print "%-20s %-8s %12s %12s %12s" % (r['scenarios'], r['mode'],
+                                             change(r['requests_per_second'], o['requests_per_second']),
+                                             change(r['latency_ms']['p50'], o['latency_ms']['p50']),
+                                             change(r['latency_ms']['p99'], o['latency_ms']['p99']))
+
+def main():
+    p = optparse.OptionParser(description='Benchmark graphserver under load',
+                              usage='usage: %prog [options] (-h for help)')
+    p.add_option('--edges', '-e', action='store',
+                 help='comma separated list of sizes in edges of generated graphs to use instead of the sample scenarios')
+    p.add_option('--fanout', '-f', action='store', default='uniform',
+                 help='fan-out distribution of the generated graphs, one of %s (default %%default)' %
+                      (', '.join(FANOUTS)))
+    p.add_option('--mode', '-m', action='store', default='single,threads,async',
+                 help='comma separated list of server modes (default %default)')
+    p.add_option('--workers', '-w', action='store', type=int, default=0,
+                 help='--workers for the server (default %default)')
+    p.add_option('--concurrency', '-c', action='store', type=int, default=4,
+                 help='number of client processes (default %default)')
+    p.add_option('--duration', '-d', action='store', type=float, default=10.0,
+                 help='seconds to run clients for each server (default %default)')
+    p.add_option('--head', action='store', type=float, default=0.1,
+                 help='fraction of requests that are HEAD rather than GET (default %default)')
+    p.add_option('--accept', action='append',
+                 help="Accept header to send, 'none' for none. Repeat for a mix, repeated values are "
+                      "chosen more often (default %s)" % (', '.join("'%s'" % a for a in DEFAULT_ACCEPTS)))
+    p.add_option('--accept-encoding', action='store',
+                 help='Accept-Encoding header to send, e.g. gzip (default none)')
+    p.add_option('--close', action='store_true',
+                 help='send Connection: close rather than keeping connections open, '
+                      'always done for single mode which serves one connection at a time')
+    p.add_option('--seed', action='store', type=int, default=1,
+                 help='random seed for the clients (default %default)')
+    p.add_option('--json', action='store',
+                 help='write results as JSON to this file')
+    p.add_option('--compare', action='store',
+                 help='compare results with those in this JSON file from an earlier run')
+    (args, extra) = p.parse_args()
+    args.accept = args.accept or DEFAULT_ACCEPTS
+
+    logging.basicConfig(level=logging.ERROR)
+    if (args.edges):
+        scenario_sets = [('%d edges' % int(e), int(e)) for e in args.edges.split(',')]
+    else:
+        scenario_sets = [('samples', None)]
+    results = []
+    print "%-20s %-8s %10s %8s %8s %8s %8s %8s %9s" % ('scenarios', 'mode', 'requests', 'errors',
+                                                       'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'peak MB')
+    for (name, edges) in scenario_sets:
+        if (edges is None):
+            dot_dir = BASE_DIR
+        else:
+            dot_dir = tempfile.mkdtemp(prefix='load_benchmark')
+            write_graph(os.path.join(dot_dir, 'bench_%d.dot' % (edges)), edges, fanout=args.fanout)
+        paths = resource_paths(dot_dir)
+        for mode in args.mode.split(','):
+            close = args.close
+            args.close = close or (mode == 'single')
+            (proc, port) = start_server(dot_dir, mode, args.workers)
+            try:
+                result = run_load(port, paths, args)
+            finally:
+                peak = stop_server(proc)
+            args.close = close
+            result.update({'scenarios': name, 'mode': mode, 'resources': len(paths),
+                           'server_peak_mb': round(peak, 1)})
+            results.append(result)
+            l = result['latency_ms']
+            print "%-20s %-8s %10d %8d %8.1f %8s %8s %8s %9.1f" % (
+                name, mode, result['requests'], result['errors'], result['requests_per_second'],
+                l['p50'], l['p90'], l['p99'], peak)
+        if (edges is not None):
+            shutil.rmtree(dot_dir)
+    config = dict((k, getattr(args, k)) for k in ('fanout', 'workers', 'concurrency', 'duration', 'head',
+                                                  'accept', 'accept_encoding', 'close', 'seed'))
+    if (args.json):
+        with open(args.json, 'w') as fh:
+            json.dump({'config': config, 'results': results}, fh, indent=2, sort_keys=True)
+    if (args.compare):
+        with open(args.compare) as fh:
+            compare(results, json.load(fh))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+parse_benchmark: compare parse time and peak memory of the native
+.dot reader and pydot on generated graphs of increasing size.
+
+Each parse is run in a forked child process so that the peak resident
+memory (ru_maxrss) is that of the one parse alone.
+
+Simeon Warner, 2015
+"""
+
+import logging
+import optparse
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from graphserver.graph import Graph
+from generate_graph import FANOUTS, write_graph
+
+def measure(file, parser):
+    """Parse file with parser in a child, return (seconds, peak KB, nodes)"""
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if (pid == 0):
+        os.close(rfd)
+        start = time.time()
+        g = Graph()
+        g.parse(file, parser)
+        os.write(wfd, "%f %d\n" % (time.time() - start, len(g.nodes)))
+        os._exit(0)
+    os.close(wfd)
+    data = os.read(rfd, 1024)
+    os.close(rfd)
+    (p, status, usage) = os.wait4(pid, 0)
+    if (status != 0 or not data):
+        return(None)
+    (seconds, nodes) = data.split()
+    return((float(seconds), usage.ru_maxrss, int(nodes)))
+
+def main():
+    p = optparse.OptionParser(description='Benchmark parsing of generated .dot files',
+                              usage='usage: %prog [options] (-h for help)')
+    p.add_option('--edges', '-e', action='store', default='10000,100000,1000000',
+                 help='comma separated list of graph sizes in edges (default %default)')
+    p.add_option('--fanout', '-f', action='store', default='uniform',
+                 help='fan-out distribution of the generated graphs, one of %s (default %%default)' %
+                      (', '.join(FANOUTS)))
+    p.add_option('--pydot-max-edges', action='store', type=int, default=100000,
+                 help='largest graph to parse with pydot, which is slow (default %default)')
+    p.add_option('--keep', action='store_true',
+                 help='keep generated .dot files')
+    (args, extra) = p.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    tmpdir = tempfile.mkdtemp(prefix='parse_benchmark')
+    print "%10s %8s %10s %10s %10s" % ('edges', 'parser', 'nodes', 'seconds', 'peak MB')
+    for edges in [int(e) for e in args.edges.split(',')]:
+        file = os.path.join(tmpdir, 'bench_%d.dot' % (edges))
+        write_graph(file, edges, fanout=args.fanout)
+        for parser in ('native', 'pydot'):
+            if (parser == 'pydot' and edges > args.pydot_max_edges):
+                continue
+            result = measure(file, parser)
+            if (result is None):
+                print "%10d %8s failed" % (edges, parser)
+                continue
+            (seconds, maxrss, nodes) = result
+            # ru_maxrss is in KB on Linux, bytes on OS X
+            mb = maxrss / (1024.0 * 1024.0) if (sys.platform == 'darwin') else maxrss / 1024.0
+            print "%10d %8s %10d %10.2f %10.1f" % (edges, parser, nodes, seconds, mb)
+        if (not args.keep):
+            os.remove(file)
+    if (not args.keep):
+        os.rmdir(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -6,16 +6,20 @@ described in a GrapgViz .dot digraph.
 Simeon Warner, 2015
 """
 
-import glob
+import atexit
 import logging
 import optparse
 import os.path
 import re
 import sys
-import BaseHTTPServer
 from graphserver.http_server import GSHTTPRequestHandler
-from graphserver.graph import Graph
-from graphserver.html_wrapper import HtmlWrapper
+from graphserver.assets import AssetStore
+from graphserver.export import StaticExport
+from graphserver.graph_cache import GraphCache
+from graphserver.loader import GraphLoader, Reloader
+from graphserver.metrics import Metrics, SampledProfiler
+from graphserver.response_cache import ResponseCache
+from graphserver.servers import MODES, server_class
 
 DEFAULT_PORT = 9876
 
@@ -29,8 +33,32 @@ def main():
                               usage='usage: %prog [options] [directory] (-h for help)')
     p.add_option('--port', '-p', action='store', type=int, default=DEFAULT_PORT,
                  help='port to run server on (default %default)')
+    p.add_option('--mode', '-m', action='store', type='choice', choices=MODES, default='single',
+                 help='concurrency mode, one of %s (default %%default)' % (', '.join(MODES)))
+    p.add_option('--workers', '-w', action='store', type=int, default=0,
+                 help='number of worker threads in threads mode (0 for a new thread per connection), or of processes in prefork mode (0 for one per CPU) (default %default)')
+    p.add_option('--status-file', action='store',
+                 help='file to write worker health to as JSON in prefork mode')
+    p.add_option('--pdf-file', action='store',
+                 help='file to serve as content of PDF resources (default examples/pdf.pdf), may be very large')
+    p.add_option('--png-file', action='store',
+                 help='file to serve as content of image resources (default examples/png.png)')
+    p.add_option('--reload', '-r', action='store', type=float, default=0,
+                 help='check for changed .dot and .svg files every RELOAD seconds and reload them (default 0, no reloading)')
+    p.add_option('--cache-dir', action='store',
+                 help='directory for cache of parsed graphs, unchanged .dot files are loaded from here without parsing')
+    p.add_option('--export', action='store',
+                 help='write the content of all resources to files in this directory, with nginx and Apache configuration to serve them, instead of running a server')
+    p.add_option('--base-uri', action='store',
+                 help='base URI for links in exported files (default http://localhost:PORT)')
+    p.add_option('--no-metrics', action='store_true',
+                 help='do not record request metrics or serve /_metrics')
+    p.add_option('--profile', action='store',
+                 help='profile a sample of requests with cProfile, writing the statistics to this file')
+    p.add_option('--profile-rate', action='store', type=int, default=100,
+                 help='with --profile, profile one in every PROFILE_RATE requests (default %default)')
     p.add_option('--verbose', '-v', action='store_true',
-                 help='verbose output')
+                 help='verbose output, including content negotiation of each request')
 
     (args, dirs) = p.parse_args()
 
@@ -45,25 +73,74 @@ def main():
         sys.exit("Supports only one base directory as argument (-h for help)")
 
     # Read graphs
-    graphs = {}
-    for dot_file in (glob.glob("%s/*.dot" % base_dir)):
-        print "Loading %s..." % (dot_file) 
-        g = Graph()
-        g.parse(dot_file)
-        if (g.name in graphs):
-                raise Exception("Duplicate graph name %s in file %s" % (g.name,dot_file))
-        graphs[g.name]=g
+    def loading(dot_file):
+        print "Loading %s..." % (dot_file)
+    graph_cache = GraphCache(args.cache_dir) if (args.cache_dir) else None
+    loader = GraphLoader(base_dir, graph_cache)
+    loader.refresh(progress=loading, strict=True)
+    graphs = loader.graphs
+
+    # Content for PDF and image resources
+    files = {}
+    if (args.pdf_file):
+        files['application/pdf'] = args.pdf_file
+    if (args.png_file):
+        files['image/png'] = args.png_file
+
+    # Export instead of running server?
+    if (args.export):
+        base_uri = args.base_uri or "http://localhost:%d" % (args.port)
+        cache = ResponseCache(graphs, base_uri.rstrip('/'), AssetStore(files))
+        cache.compile()
+        num = StaticExport(cache, args.export).export()
+        print "Exported %d resources to %s" % (num, args.export)
+        return
+
+    # Instrumentation
+    if (not args.no_metrics):
+        GSHTTPRequestHandler.metrics = Metrics()
+    if (args.profile):
+        GSHTTPRequestHandler.profiler = SampledProfiler(args.profile, args.profile_rate)
+        atexit.register(GSHTTPRequestHandler.profiler.dump)
 
     # Run server
-    run(GSHTTPRequestHandler, BaseHTTPServer.HTTPServer, port=args.port, graphs=graphs)
+    run(GSHTTPRequestHandler, server_class(args.mode, args.workers, args.status_file), port=args.port, graphs=graphs,
+        assets=AssetStore(files), loader=loader, reload_interval=args.reload)
+
+def compile_cache(HandlerClass, graphs, assets=None, loader=None, changed=()):
+    """Compile responses for graphs and install them in HandlerClass
+
+    If HandlerClass already has a cache then responses for graphs not
+    named in changed are reused. With a loader the load status of the
+    graphs is added at /_admin/graphs.
+    """
+    cache = ResponseCache(graphs, HandlerClass.base_uri, assets)
+    num = cache.compile(previous=getattr(HandlerClass, 'cache', None), changed=changed)
+    if (loader is not None):
+        status = loader.status()
+        for s in status:
+            seconds = cache.compile_seconds.get(s['name'])
+            s['compile_seconds'] = round(seconds, 6) if (seconds is not None) else None
+        cache.add_json('/_admin/graphs', {'graphs': status})
+    # Swap in new cache, which has the graphs, in one assignment. Each
+    # request reads the cache once so requests in progress keep the old
+    HandlerClass.cache = cache
+    return(num)
 
-def run(HandlerClass, ServerClass, port, graphs):
+def run(HandlerClass, ServerClass, port, graphs, assets=None, loader=None, reload_interval=0):
     protocol='HTTP/1.1'
     server_address = ('localhost', port)
     HandlerClass.protocol_version = protocol
-    HandlerClass.graphs = graphs
     HandlerClass.base_uri = "http://%s:%d" % server_address
+    print "Compiled %d responses" % (compile_cache(HandlerClass, graphs, assets, loader))
     httpd = ServerClass(server_address, HandlerClass)
+    if (loader is not None and reload_interval > 0):
+        def reload(loader, changed):
+            compile_cache(HandlerClass, loader.graphs, assets, loader, changed)
+            # Pre-forked workers have copies of the old graphs
+            if (hasattr(httpd, 'graceful_restart')):
+                httpd.graceful_restart()
+        Reloader(loader, reload, reload_interval).start()
     sa = httpd.socket.getsockname()
     print "Serving HTTP on %s port %d..." % sa
     httpd.serve_forever()
@@ -1,3 +1,2 @@
 #from _version import __version__
 from http_server import GSHTTPRequestHandler
-from html_wrapper import HtmlWrapper
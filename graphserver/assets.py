@@ -0,0 +1,162 @@
+"""Static assets served by graphserver
+
+The example PNG and PDF content used for image and PDF nodes, and
+the CSS, are loaded once. Small files are kept in memory and shared
+by all responses that use them. Large files (for example substitute
+PDFs of hundreds of MB for download stress tests) are not read into
+memory but are sent with sendfile(2), or from an mmap where sendfile
+is not available.
+
+Simeon Warner, 2015
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import select
+import socket
+import sys
+
+class StaticAsset(object):
+
+    """A static file served as the content of responses
+
+    If the file is no larger than max_memory_size then its content is
+    in self.data, otherwise self.data is None and the content must be
+    sent with send_to().
+    """
+
+    max_memory_size = 1024*1024
+    chunk_size = 1024*1024
+
+    def __init__(self, path, max_memory_size=None):
+        self.path = path
+        if (max_memory_size is not None):
+            self.max_memory_size = max_memory_size
+        self.fd = os.open(path, os.O_RDONLY)
+        st = os.fstat(self.fd)
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.mmap = None
+        if (self.size <= self.max_memory_size):
+            self.data = os.read(self.fd, self.size) if (self.size > 0) else ''
+            while (len(self.data) < self.size):
+                self.data += os.read(self.fd, self.size - len(self.data))
+            os.close(self.fd)
+            self.fd = None
+            self.etag = '"%s"' % hashlib.sha1(self.data).hexdigest()
+        else:
+            self.data = None
+            self.mmap = mmap.mmap(self.fd, self.size, access=mmap.ACCESS_READ)
+            # Avoid hashing very large files, use size and mtime instead
+            self.etag = '"%x-%x"' % (self.size, int(self.mtime))
+
+    def chunks(self, chunk_size=None):
+        """Generator of content in chunks, buffers of the mmap if large"""
+        if (self.data is not None):
+            yield self.data
+            return
+        chunk_size = chunk_size or self.chunk_size
+        for offset in xrange(0, self.size, chunk_size):
+            yield buffer(self.mmap, offset, chunk_size)
+
+    def send_to(self, sock):
+        """Send whole content to connected socket sock
+        """
+        if (self.data is not None):
+            sock.sendall(self.data)
+        elif (not sendfile(sock, self.fd, self.size)):
+            for chunk in self.chunks():
+                sock.sendall(chunk)
+
+    def __repr__(self):
+        return "StaticAsset(%s, %d bytes)" % (self.path, self.size)
+
+class AssetStore(object):
+
+    """Set of static assets used for node content, by MIME type
+
+    Files are set with the file_for_type dict of MIME type to path,
+    and are loaded once on first use.
+    """
+
+    file_for_type = {'image/png': 'examples/png.png',
+                     'application/pdf': 'examples/pdf.pdf'}
+
+    def __init__(self, file_for_type=None, max_memory_size=None):
+        self.file_for_type = dict(self.file_for_type)
+        if (file_for_type):
+            self.file_for_type.update(file_for_type)
+        self.max_memory_size = max_memory_size
+        self.assets = {}
+        self.log = logging.getLogger('assets')
+
+    def get(self, path):
+        """Return StaticAsset for file path, raise IOError/OSError if bad"""
+        if (path not in self.assets):
+            self.assets[path] = StaticAsset(path, self.max_memory_size)
+            self.log.info("Loaded %s" % (str(self.assets[path])))
+        return(self.assets[path])
+
+    def for_type(self, mime_type):
+        """Return StaticAsset used as content for mime_type, else None"""
+        if (mime_type not in self.file_for_type):
+            return(None)
+        return(self.get(self.file_for_type[mime_type]))
+
+# sendfile(2): os.sendfile in python3, else libc via ctypes on Linux
+_libc_sendfile = None
+if (not hasattr(os, 'sendfile') and sys.platform.startswith('linux')):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc_sendfile = _libc.sendfile
+        _libc_sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                                   ctypes.POINTER(ctypes.c_long), ctypes.c_size_t]
+        _libc_sendfile.restype = ctypes.c_ssize_t
+    except (OSError, AttributeError):
+        _libc_sendfile = None
+
+def _sendfile(out_fd, in_fd, offset, count):
+    if (hasattr(os, 'sendfile')):
+        return(os.sendfile(out_fd, in_fd, offset, count))
+    off = ctypes.c_long(offset)
+    sent = _libc_sendfile(out_fd, in_fd, ctypes.byref(off), count)
+    if (sent < 0):
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return(sent)
+
+def sendfile(sock, fd, size):
+    """Send size bytes from file descriptor fd to sock using sendfile(2)
+
+    Returns False without sending anything if sendfile is not available,
+    True once everything has been sent.
+    """
+    if (not hasattr(os, 'sendfile') and _libc_sendfile is None):
+        return(False)
+    try:
+        out_fd = sock.fileno()
+    except (AttributeError, socket.error):
+        return(False)
+    offset = 0
+    while (offset < size):
+        try:
+            sent = _sendfile(out_fd, fd, offset, min(size - offset, 0x7ffff000))
+        except OSError as e:
+            if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                # Socket has a timeout so is non-blocking underneath
+                (r, writable, x) = select.select([], [out_fd], [], sock.gettimeout())
+                if (not writable):
+                    raise socket.timeout("sendfile: timed out")
+                continue
+            elif (e.errno in (errno.EINVAL, errno.ENOSYS) and offset == 0):
+                return(False)
+            raise
+        if (sent == 0):
+            raise socket.error(errno.EPIPE, "sendfile: connection closed")
+        offset += sent
+    return(True)
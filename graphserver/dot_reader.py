@@ -0,0 +1,224 @@
+"""Fast reader for the subset of GraphViz DOT used by graphserver
+
+Reads a digraph in a single pass over the file, line by line, and
+calls back for each node and edge statement, so that neither the
+text nor a parse tree of the whole file is held in memory. Supported
+are: comments, one (strict) digraph, node and edge statements (with
+edge chains a -> b -> c), attribute lists, graph/node/edge attribute
+statements and ID=ID assignments (both ignored), and subgraphs.
+
+Anything else (ports, HTML strings, '+' concatenation of strings,
+subgraphs as edge endpoints, undirected graphs) raises DotSyntaxError
+so that the caller can fall back to pydot.
+
+IDs and attribute values are returned as in the file, without
+surrounding quotes but with escapes intact, as pydot does.
+
+Simeon Warner, 2015
+"""
+
+import re
+
+class DotSyntaxError(Exception):
+    pass
+
+# One token per match, groups: 1 string, 2 identifier or numeral,
+# 3 edge operator or punctuation
+TOKEN_RE = re.compile(r'''
+    \s+ | //[^\n]* | /\*.*?\*/ |
+    "((?:[^"\\]|\\.|\\\n)*)" |
+    ([A-Za-z_\x80-\xff][A-Za-z_0-9\x80-\xff]* | -?(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?)) |
+    (->|--|[{}\[\];,=:+<])
+''', re.X | re.S)
+
+KEYWORDS = ('graph', 'node', 'edge', 'digraph', 'subgraph', 'strict')
+
+class Token(object):
+
+    __slots__ = ('kind', 'value', 'line')
+
+    def __init__(self, kind, value, line):
+        self.kind = kind # 'id', 'keyword' or 'punct'
+        self.value = value
+        self.line = line
+
+def tokenize(fh):
+    """Generator of Tokens read from file handle fh, line by line
+
+    Lines are joined only while a quoted string or a block comment
+    is open.
+    """
+    pending = ''
+    lineno = 0
+    for line in fh:
+        lineno += 1
+        if (not pending and line.startswith('#')):
+            continue # C preprocessor output line
+        text = pending + line
+        pending = ''
+        pos = 0
+        end = len(text)
+        while (pos < end):
+            m = TOKEN_RE.match(text, pos)
+            if (m is None):
+                rest = text[pos:]
+                if (rest.startswith('"') or rest.startswith('/*')):
+                    # Unterminated, continue with next line
+                    pending = rest
+                    break
+                raise DotSyntaxError("Unexpected character %r at line %d" % (text[pos], lineno))
+            pos = m.end()
+            if (m.group(1) is not None):
+                yield Token('id', m.group(1).replace('\\\n', ''), lineno)
+            elif (m.group(2) is not None):
+                value = m.group(2)
+                if (value.lower() in KEYWORDS):
+                    yield Token('keyword', value.lower(), lineno)
+                else:
+                    yield Token('id', value, lineno)
+            elif (m.group(3) is not None):
+                yield Token('punct', m.group(3), lineno)
+    if (pending):
+        raise DotSyntaxError("Unterminated string or comment at end of file")
+
+class DotReader(object):
+
+    """Reader for a DOT digraph, calls back for each node and edge
+
+    Callbacks are graph(name), node(name, attrs) and edge(src, dst,
+    attrs) where attrs is a dict. Edges are reported in file order.
+    """
+
+    def __init__(self, graph=None, node=None, edge=None):
+        self.on_graph = graph
+        self.on_node = node
+        self.on_edge = edge
+
+    def read(self, file):
+        """Read DOT file, making callbacks"""
+        with open(file, 'r') as fh:
+            self.read_fh(fh)
+
+    def read_fh(self, fh):
+        self.tokens = tokenize(fh)
+        self.tok = None
+        self.advance()
+        if (self.is_keyword('strict')):
+            self.advance()
+        if (not self.is_keyword('digraph')):
+            self.error("Expected digraph")
+        self.advance()
+        name = None
+        if (self.tok is not None and self.tok.kind == 'id'):
+            name = self.tok.value
+            self.advance()
+        if (self.on_graph):
+            self.on_graph(name)
+        self.expect('{')
+        self.stmt_list()
+        self.expect('}')
+        if (self.tok is not None):
+            self.error("Only one graph per file is supported")
+
+    def advance(self):
+        try:
+            self.tok = next(self.tokens)
+        except StopIteration:
+            self.tok = None
+
+    def is_punct(self, value):
+        return(self.tok is not None and self.tok.kind == 'punct' and self.tok.value == value)
+
+    def is_keyword(self, value):
+        return(self.tok is not None and self.tok.kind == 'keyword' and self.tok.value == value)
+
+    def expect(self, value):
+        if (not self.is_punct(value)):
+            self.error("Expected '%s'" % (value))
+        self.advance()
+
+    def expect_id(self):
+        if (self.tok is None or self.tok.kind != 'id'):
+            self.error("Expected ID")
+        value = self.tok.value
+        self.advance()
+        if (self.is_punct('+')):
+            self.error("String concatenation is not supported")
+        return(value)
+
+    def error(self, msg):
+        if (self.tok is None):
+            raise DotSyntaxError("%s at end of file" % (msg))
+        raise DotSyntaxError("%s at line %d, got %r" % (msg, self.tok.line, self.tok.value))
+
+    def stmt_list(self):
+        while (self.tok is not None and not self.is_punct('}')):
+            self.stmt()
+            if (self.is_punct(';')):
+                self.advance()
+
+    def stmt(self):
+        if (self.is_keyword('graph') or self.is_keyword('node') or self.is_keyword('edge')):
+            # Default attributes, ignored
+            self.advance()
+            self.attr_list()
+        elif (self.is_keyword('subgraph') or self.is_punct('{')):
+            self.subgraph()
+            if (self.is_punct('->') or self.is_punct('--')):
+                self.error("Subgraph as edge endpoint is not supported")
+        elif (self.tok.kind == 'id'):
+            name = self.node_id()
+            if (self.is_punct('=')):
+                # Graph attribute assignment, ignored
+                self.advance()
+                self.expect_id()
+                return
+            names = [name]
+            while (self.is_punct('->')):
+                self.advance()
+                if (self.is_keyword('subgraph') or self.is_punct('{')):
+                    self.error("Subgraph as edge endpoint is not supported")
+                names.append(self.node_id())
+            if (self.is_punct('--')):
+                self.error("Undirected edges are not supported")
+            attrs = self.attr_list()
+            if (len(names) == 1):
+                if (self.on_node):
+                    self.on_node(name, attrs)
+            elif (self.on_edge):
+                for j in range(1, len(names)):
+                    self.on_edge(names[j-1], names[j], attrs)
+        else:
+            self.error("Unexpected token")
+
+    def subgraph(self):
+        if (self.is_keyword('subgraph')):
+            self.advance()
+            if (self.tok is not None and self.tok.kind == 'id'):
+                self.advance()
+        self.expect('{')
+        self.stmt_list()
+        self.expect('}')
+
+    def node_id(self):
+        name = self.expect_id()
+        if (self.is_punct(':')):
+            self.error("Ports are not supported")
+        return(name)
+
+    def attr_list(self):
+        """Return dict of attributes from zero or more [...] lists"""
+        attrs = {}
+        while (self.is_punct('[')):
+            self.advance()
+            while (not self.is_punct(']')):
+                name = self.expect_id()
+                value = 'true'
+                if (self.is_punct('=')):
+                    self.advance()
+                    value = self.expect_id()
+                attrs[name] = value
+                if (self.is_punct(',') or self.is_punct(';')):
+                    self.advance()
+            self.advance()
+        return(attrs)
@@ -0,0 +1,184 @@
+"""Static export of the responses for a set of graphs
+
+Every response that graphserver sends, except the results of content
+negotiation, depends only on the .dot files, so the content can be
+written to files and served by nginx or Apache with configuration
+that adds the same headers. Conneg redirects are done by matching the
+Accept header with regular expressions, which is an approximation of
+the negotiation in graphserver: a content type named in the Accept
+header is selected (the first of the node's types if several are
+named), q values are not taken into account, and an Accept header
+that names none of them gets the default.
+
+Not exported are the paged index (/?page=...), /_metrics, the
+/GRAPH/_resolve API, and /GRAPH/_paths/node which are built on
+request.
+
+Simeon Warner, 2015
+"""
+
+import logging
+import mimetypes
+import os
+import os.path
+import re
+import shutil
+import urlparse
+
+class StaticExport(object):
+
+    """Write the responses in a compiled ResponseCache to out_dir
+
+    The content of each response is written to out_dir/files, named
+    by its ETag so that content shared by many resources (such as the
+    PDF and image content) is written once. Where there is a gzip
+    variant it is written alongside with .gz added, for nginx
+    gzip_static. The configuration is written to out_dir/nginx.conf
+    and out_dir/apache.conf.
+    """
+
+    def __init__(self, cache, out_dir):
+        self.cache = cache
+        self.out_dir = os.path.abspath(out_dir)
+        self.files_dir = os.path.join(self.out_dir, 'files')
+        self.resources = []
+        self.log = logging.getLogger('export')
+
+    def export(self):
+        """Write files and server configuration, return number of resources"""
+        if (not os.path.isdir(self.files_dir)):
+            os.makedirs(self.files_dir)
+        self.resources = []
+        for path in sorted(self.cache.responses):
+            response = self.cache.responses[path]
+            if (response.code == 200):
+                self.resources.append(self.resource(path, response))
+        for path in sorted(self.cache.conneg):
+            resource = self.cache.conneg[path]
+            r = self.resource(path, resource.variants[None])
+            r['headers'].append(('Vary', 'Accept'))
+            for content_type in sorted(t for t in resource.variants if t is not None):
+                variant = resource.variants[content_type]
+                r['redirects'].append((content_type, variant.code,
+                                       dict(variant.headers)['Location']))
+            r['default'] = resource.default_content_type
+            self.resources.append(r)
+        self.resources.sort(key=lambda r: r['path'])
+        with open(os.path.join(self.out_dir, 'nginx.conf'), 'w') as fh:
+            fh.write(self.nginx_config())
+        with open(os.path.join(self.out_dir, 'apache.conf'), 'w') as fh:
+            fh.write(self.apache_config())
+        self.log.info("Exported %d resources to %s", len(self.resources), self.out_dir)
+        return(len(self.resources))
+
+    def resource(self, path, response):
+        """Write content of response, return dict describing resource at path"""
+        headers = [(name, value) for (name, value) in response.headers
+                   if (name not in ('Content-Type', 'Vary', 'Location'))]
+        content_type = dict(response.headers).get('Content-Type')
+        if (content_type is None):
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        file = self.write_content(response)
+        paths = [path]
+        if (path.lstrip('/') in self.cache.graphs):
+            paths.append(path + '/')
+        return({'path': path, 'paths': paths, 'file': file, 'content_type': content_type,
+                'headers': headers, 'redirects': [], 'default': None})
+
+    def write_content(self, response):
+        """Write content of response (and gzip variant) if not already written, return file name"""
+        name = response.etag.strip('"')
+        file = os.path.join(self.files_dir, name)
+        if (not os.path.exists(file)):
+            self.write_file(file, response)
+            gzip = (response.encoded or {}).get('gzip')
+            if (gzip is not None):
+                self.write_file(file + '.gz', gzip)
+        return(file)
+
+    def write_file(self, file, response):
+        """Write content of response to file"""
+        if (response.asset is not None):
+            shutil.copyfile(response.asset.path, file)
+            return
+        with open(file, 'wb') as fh:
+            if (response.stream is not None):
+                for chunk in response.stream():
+                    fh.write(chunk)
+            else:
+                fh.write(response.body)
+
+    def listen_port(self):
+        """Return port of the base URI the responses were compiled for"""
+        return(urlparse.urlparse(self.cache.renderer.base_uri).port or 80)
+
+    def accept_re(self, content_type):
+        """Return regex matching an Accept header that names content_type"""
+        return('(^|[ ,])%s($|[ ,;])' % (re.escape(content_type)))
+
+    def nginx_config(self):
+        """Return nginx configuration to serve the exported files
+
+        The map blocks must be in the http context, the server block
+        listens on the port of the base URI.
+        """
+        lines = ["# nginx configuration generated by graphserver.py --export\n",
+                 "# include in the http block of nginx.conf\n\n"]
+        maps = {}
+        for r in self.resources:
+            if (r['redirects']):
+                key = (tuple(t for (t, code, location) in r['redirects']), r['default'])
+                if (key not in maps):
+                    maps[key] = '$graphserver_conneg_%d' % (len(maps) + 1)
+                    lines.append("map $http_accept %s {\n" % (maps[key]))
+                    lines.append('    "" "";\n')
+                    for (content_type, code, location) in r['redirects']:
+                        lines.append('    "~*%s" "%s";\n' % (self.accept_re(content_type), content_type))
+                    lines.append('    default "%s";\n}\n\n' % (r['default']))
+        lines.append("server {\n    listen %d;\n    gzip_static on;\n    gzip_vary on;\n\n" %
+                     (self.listen_port()))
+        for r in self.resources:
+            for path in r['paths']:
+                lines.append('    location = "%s" {\n' % (nginx_escape(path)))
+                if (r['redirects']):
+                    var = maps[(tuple(t for (t, code, location) in r['redirects']), r['default'])]
+                    for (content_type, code, location) in r['redirects']:
+                        lines.append('        if (%s = "%s") { return %d "%s"; }\n' %
+                                     (var, content_type, code, nginx_escape(location)))
+                lines.append('        types { }\n        default_type "%s";\n' % (r['content_type']))
+                for (name, value) in r['headers']:
+                    lines.append('        add_header %s "%s" always;\n' % (name, nginx_escape(value)))
+                lines.append('        alias "%s";\n    }\n' % (nginx_escape(r['file'])))
+        lines.append("}\n")
+        return(''.join(lines))
+
+    def apache_config(self):
+        """Return Apache 2.4 configuration to serve the exported files
+
+        For the server or virtual host context, needs mod_alias,
+        mod_headers and mod_rewrite. Content is not compressed.
+        """
+        lines = ["# Apache configuration generated by graphserver.py --export\n",
+                 "# include in the server or virtual host config, needs mod_alias,\n",
+                 "# mod_headers and mod_rewrite\n\n",
+                 '<Directory "%s">\n    Require all granted\n</Directory>\n\n' % (self.files_dir),
+                 "RewriteEngine On\n\n"]
+        for r in self.resources:
+            regex = '^%s/?$' % (re.escape(r['path'])) if (len(r['paths']) > 1) else '^%s$' % (re.escape(r['path']))
+            for (content_type, code, location) in r['redirects']:
+                lines.append('RewriteCond %%{HTTP:Accept} "%s" [NC]\n' % (self.accept_re(content_type)))
+                lines.append('RewriteRule "%s" "%s" [R=%d,L]\n' % (regex, location, code))
+            for (content_type, code, location) in r['redirects']:
+                if (content_type == r['default']):
+                    lines.append('RewriteCond %{HTTP:Accept} "."\n')
+                    lines.append('RewriteRule "%s" "%s" [R=%d,L]\n' % (regex, location, code))
+            lines.append('AliasMatch "%s" "%s"\n' % (regex, r['file']))
+            lines.append('<LocationMatch "%s">\n    ForceType %s\n' % (regex, r['content_type']))
+            for (name, value) in r['headers']:
+                lines.append('    Header always add %s "%s"\n' % (name, value.replace('"', '\\"')))
+            lines.append("</LocationMatch>\n\n")
+        return(''.join(lines))
+
+def nginx_escape(value):
+    """Return value escaped for use in a double quoted nginx string"""
+    return(value.replace('\\', '\\\\').replace('"', '\\"'))
@@ -2,42 +2,281 @@
 
 Simeon Warner, 2015-03-06
 """
+import array
+import collections
 import logging
 import os.path
-import pydot
 import re
+from graphserver.dot_reader import DotReader, DotSyntaxError
+try:
+    import pydot
+except ImportError:
+    pydot = None
+
+class Symbols(object):
+
+    """Table of interned strings, each with an integer id
+
+    Node names, rels, MIME types and content types are stored once
+    and referred to by id in the tables of each Node. Id 0 is None.
+    """
+
+    def __init__(self):
+        self.strings = [None]
+        self.ids = {None: 0}
+
+    def id(self, string):
+        """Return id of string, adding it to the table if new"""
+        i = self.ids.get(string)
+        if (i is None):
+            if (type(string) is str):
+                string = intern(string)
+            i = len(self.strings)
+            self.strings.append(string)
+            self.ids[string] = i
+        return(i)
+
+    def intern(self, string):
+        """Return the copy of string held in the table"""
+        return(self.strings[self.id(string)])
 
 """A node that represents a web resource
 
 Has a name (relative URI), possibly conneg rules
 of mime type and redirect code, possibly Link headers. 
+
+To keep very large graphs compact the conneg rules, links, HTML
+links and HTML imgs are held in arrays of ids in the Symbols table
+shared by all nodes of a graph. The conneg, links, html_links and
+html_imgs properties expand these to the dict of content type to
+[code, dst, default], list of [rel, dst, mime_type] and lists of dst
+names. Add to them with add_conneg(), add_link(), add_html_link()
+and add_html_img() (changing the expanded copies has no effect).
 """
 class Node(object):
 
-    def __init__(self, name=None):
-        self.name = name
+    __slots__ = ('name', 'mime_type', 'symbols', 'conneg_table', 'link_table',
+                 'html_link_table', 'html_img_table')
+
+    def __init__(self, name=None, symbols=None):
+        self.symbols = symbols if (symbols is not None) else Symbols()
+        self.name = self.symbols.intern(name)
         self.mime_type = None
-        self.conneg = {}
-        self.links = []
-        self.html_links = []
-        self.html_imgs = []
+        self.conneg_table = None   # (content_type, code, dst, default) ...
+        self.link_table = None     # (rel, dst, mime_type) ...
+        self.html_link_table = None
+        self.html_img_table = None
+
+    def add_conneg(self, content_type, code, dst, default=False):
+        """Add or replace conneg rule for content_type"""
+        ct_id = self.symbols.id(content_type)
+        entry = [ct_id, code, self.symbols.id(dst), 1 if default else 0]
+        t = self.conneg_table
+        if (t is None):
+            self.conneg_table = array.array('i', entry)
+            return
+        for j in xrange(0, len(t), 4):
+            if (t[j] == ct_id):
+                t[j:j+4] = array.array('i', entry)
+                return
+        t.extend(entry)
+
+    def add_link(self, rel, dst, mime_type=None):
+        """Add link with relation rel to dst, with optional mime_type"""
+        entry = [self.symbols.id(rel), self.symbols.id(dst), self.symbols.id(mime_type)]
+        if (self.link_table is None):
+            self.link_table = array.array('i', entry)
+        else:
+            self.link_table.extend(entry)
+
+    def add_html_link(self, dst):
+        if (self.html_link_table is None):
+            self.html_link_table = array.array('i')
+        self.html_link_table.append(self.symbols.id(dst))
+
+    def add_html_img(self, dst):
+        if (self.html_img_table is None):
+            self.html_img_table = array.array('i')
+        self.html_img_table.append(self.symbols.id(dst))
+
+    @property
+    def conneg(self):
+        conneg = {}
+        t = self.conneg_table
+        if (t is not None):
+            s = self.symbols.strings
+            for j in xrange(0, len(t), 4):
+                conneg[s[t[j]]] = [t[j+1], s[t[j+2]], bool(t[j+3])]
+        return(conneg)
+
+    @conneg.setter
+    def conneg(self, conneg):
+        self.conneg_table = None
+        for content_type in conneg:
+            (code, dst, default) = conneg[content_type]
+            self.add_conneg(content_type, code, dst, default)
+
+    @property
+    def links(self):
+        t = self.link_table
+        if (t is None):
+            return([])
+        s = self.symbols.strings
+        return([[s[t[j]], s[t[j+1]], s[t[j+2]]] for j in xrange(0, len(t), 3)])
+
+    @links.setter
+    def links(self, links):
+        self.link_table = None
+        for (rel, dst, mime_type) in links:
+            self.add_link(rel, dst, mime_type)
+
+    @property
+    def html_links(self):
+        s = self.symbols.strings
+        return([s[i] for i in (self.html_link_table or ())])
+
+    @html_links.setter
+    def html_links(self, html_links):
+        self.html_link_table = None
+        for dst in html_links:
+            self.add_html_link(dst)
+
+    @property
+    def html_imgs(self):
+        s = self.symbols.strings
+        return([s[i] for i in (self.html_img_table or ())])
+
+    @html_imgs.setter
+    def html_imgs(self, html_imgs):
+        self.html_img_table = None
+        for dst in html_imgs:
+            self.add_html_img(dst)
+
+class MimeTypeRules(object):
+
+    """Ordered rules to infer the MIME type of a node from its name
+
+    Each rule is a (pattern, mime_type) pair, the first pattern found
+    anywhere in the name (ignoring case) gives the MIME type. Instances
+    are callable with a name and return the MIME type or None.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.compiled = [(re.compile(pattern, re.I), mime_type)
+                         for (pattern, mime_type) in self.rules]
+
+    def __call__(self, name):
+        for (regex, mime_type) in self.compiled:
+            if (regex.search(name)):
+                return(mime_type)
+        return(None)
+
+    def __repr__(self):
+        return("MimeTypeRules(%r)" % (self.rules))
+
+# A little fudging to infer type from name
+DEFAULT_MIME_TYPE_RULES = MimeTypeRules([
+    ('HTML|Splash|Choice', 'text/html'),
+    ('PDF', 'application/pdf'),
+    ('RDF', 'text/turtle'),
+    ('IMG', 'image/png')])
 
 """A node-oriented view of a GraphViz graph for modeling web resources
 
 Each node corresponds to a web resource and we accumulate the properties
-of each node from the data in the pydot.Graph.
+of each node from the nodes and edges of the dot file, read either with
+graphserver.dot_reader or with pydot.
 """
 class Graph(object):
 
+    # Parser used by parse() if not specified, see parse()
+    parser = None
+
+    # Callable giving MIME type of new node from name, see add_node()
+    mime_type_rules = DEFAULT_MIME_TYPE_RULES
+
+    # Edge label classification, the method of the first pattern that
+    # matches the start of the normalized label is called with the
+    # source node, destination name, label and match object. Labels
+    # that match none are a set of links, see add_links_edge()
+    edge_label_rules = [
+        (re.compile(r'conneg(\s+(\d+))?(\s+(\S+))?'), 'add_conneg_edge'),
+        (re.compile(r'html\s+link', re.I), 'add_html_link_edge'),
+        (re.compile(r'html\s+img', re.I), 'add_html_img_edge')]
+
+    mime_type_re = re.compile(r'\w+/\w+$')
+    name_space_re = re.compile(r'(\s|\\n)+')
+
     def __init__(self, g=None, name=None, nodes=None):
         self.g = g
         self.name = name
         self.nodes = nodes if (nodes is not None) else {}
+        self.node_names = None #sorted node names, see sorted_node_names()
+        self.symbols = Symbols()
+        self.fragments = {}
+        self.adjacency = {}
+        self.cycles = []
+        self.conneg_default = True #first conneg edge will be default
         self.svg = None
+        self.file = None
+        self.mtime = None
         self.log = logging.getLogger('graph')
 
-    def parse(self, file):
+    def parse(self, file, parser=None):
+        """Parse GraphViz dot file to populate this graph
+
+        The parser may be 'native' (graphserver.dot_reader), 'pydot', or
+        None to use the native reader with pydot as a fallback for files
+        that use DOT features not supported by the native reader.
+        """
+        self.file = file
+        self.mtime = os.path.getmtime(file)
+        parser = parser or self.parser
+        if (parser != 'pydot'):
+            try:
+                self.parse_native(file)
+            except DotSyntaxError as e:
+                if (parser == 'native' or pydot is None):
+                    raise
+                self.log.warn("Native parse of %s failed (%s), using pydot" % (file, str(e)))
+                self.nodes = {}
+                self.node_names = None
+                self.parse_pydot(file)
+        else:
+            self.parse_pydot(file)
+
+        # Do we have an svg file for this graph?
+        svg_file = os.path.splitext(file)[0] + '.svg'
+        if (os.path.exists(svg_file)):
+            self.svg=svg_file
+
+        self.index_fragments()
+        self.index_adjacency()
+        self.sorted_node_names()
+
+    def parse_native(self, file):
+        """Parse dot file with the native single-pass reader
+
+        Nodes and edges are added as they are read, edges in file order.
+        """
+        self.g = None
+        self.conneg_default = True #first conneg edge will be default
+        def graph(name):
+            self.name = name
+            self.log.info("##### GRAPH NAME %s..." % (self.name))
+        def node(name, attrs):
+            self.add_node(name)
+        def edge(src, dst, attrs):
+            self.add_edge(src, dst, attrs.get('label'))
+        DotReader(graph=graph, node=node, edge=edge).read(file)
+
+    def parse_pydot(self, file):
+        """Parse dot file with pydot
+        """
         self.g = pydot.graph_from_dot_file(file)
+        if (self.g is None):
+            raise ValueError("Failed to parse %s with pydot" % (file))
 
         self.name = self.g.get_name()
         self.log.info("##### GRAPH NAME %s..." % (self.name))
@@ -51,77 +290,350 @@ class Graph(object):
             node = self.add_node(n.get_name())
             
         self.log.info("edges:")
-        conneg_default = True #first conneg edge will be default
+        self.conneg_default = True #first conneg edge will be default
         for e in self.g.get_edges():
-            src = self.add_node(e.get_source())
-            dst_name = self.add_node(e.get_destination()).name
-            label = self.normalize_label(e.get_label())
-            m = re.match( r'conneg(\s+(\d+))?(\s+(\S+))?', label )
+            self.add_edge(e.get_source(), e.get_destination(), e.get_label())
+
+    def add_edge(self, src_name, dst_name, label):
+        """Add edge from src_name to dst_name, interpreting label
+
+        The label says whether the edge is a conneg rule, an HTML link
+        or img, or a set of HTTP links (see graphserver.md).
+        """
+        src = self.add_node(src_name)
+        dst_name = self.add_node(dst_name).name
+        if (label is None):
+            self.log.warn("Ignoring edge %s -> %s without label", src.name, dst_name)
+            return
+        label = self.normalize_label(label)
+        for (regex, method) in self.edge_label_rules:
+            m = regex.match(label)
             if (m):
-                if (m.group(4) is None):
-                    self.log.info("Bad conneg label: %s" % (label))
-                else:
-                    code = int(m.group(2))
-                    content_type = m.group(4)
-                    self.log.info("%s conneg %s, %d -> %s" % (src.name, content_type, code, dst_name))
-                    src.conneg[content_type] = [code,dst_name,conneg_default]
-                    conneg_default = False
-            elif (re.match('html\s+link',label,re.I)):
-                src.html_links.append(dst_name)
-            elif (re.match('html\s+img',label,re.I)):
-                src.html_imgs.append(dst_name)
+                getattr(self, method)(src, dst_name, label, m)
+                return
+        self.add_links_edge(src, dst_name, label)
+
+    def add_conneg_edge(self, src, dst_name, label, m):
+        """Add conneg rule from label 'conneg code content_type'"""
+        if (m.group(2) is None or m.group(4) is None):
+            self.log.info("Bad conneg label: %s", label)
+            return
+        code = int(m.group(2))
+        content_type = m.group(4)
+        self.log.info("%s conneg %s, %d -> %s", src.name, content_type, code, dst_name)
+        src.add_conneg(content_type, code, dst_name, self.conneg_default)
+        self.conneg_default = False
+
+    def add_html_link_edge(self, src, dst_name, label, m):
+        src.add_html_link(dst_name)
+
+    def add_html_img_edge(self, src, dst_name, label, m):
+        src.add_html_img(dst_name)
+
+    def add_links_edge(self, src, dst_name, label):
+        """Add links from space separated rels, last word might be mime type"""
+        words = label.split()
+        mime_type = None
+        if (words and '/' in words[-1] and self.mime_type_re.match(words[-1])):
+            mime_type = words.pop()
+        for rel in words:
+            self.log.info("%s rel=\"%s\" %s %s", src.name, rel, dst_name, mime_type)
+            src.add_link(rel, dst_name, mime_type)
+
+    def index_fragments(self):
+        """Build index self.fragments of fragment nodes for each parent node
+
+        A node name such as "Splash_Page#img" is a fragment "img" of the
+        node "Splash_Page". For each parent node name, self.fragments has
+        a list of (frag, frag_node_name, warnings) sorted by frag, where
+        warnings is the list from check_fragment().
+        """
+        self.fragments = {}
+        for name in self.nodes:
+            i = name.find('#')
+            while (i >= 0):
+                parent = name[:i]
+                frag = name[i+1:]
+                if (frag and parent in self.nodes):
+                    warnings = self.check_fragment(self.nodes[name], self.nodes[parent])
+                    self.fragments.setdefault(parent, []).append((frag, name, warnings))
+                i = name.find('#', i+1)
+        for parent in self.fragments:
+            self.fragments[parent].sort()
+
+    def check_fragment(self, frag_node, parent_node):
+        """Check to see whether frag node is compatible with parent
+
+        Returns list of warnings, empty if OK
+        """
+        warnings = []
+        # mime_types should be the same
+        if (frag_node.mime_type != parent_node.mime_type):
+            warnings.append("MIME type mismatch: %s vs %s" %
+                            (frag_node.mime_type, parent_node.mime_type))
+        # links should be the same
+        links = {}
+        for l in frag_node.links:
+            links[str(l)]='fragment'
+        for l in parent_node.links:
+            s=str(l)
+            if (s in links):
+                del links[s]
             else:
-                # assume space separated set of links (last word might me mime type)
-                words = label.split()
-                mime_type = None
-                if (re.match(r'\w+/\w+$',words[-1])):
-                    mime_type = words.pop()
-                for rel in words:
-                    self.log.info("%s rel=\"%s\" %s %s" % (src.name,rel,dst_name,mime_type))
-                    src.links.append([rel,dst_name,mime_type])
-
-            # Do we have an svg file for this graph?
+                links[s]='parent'
+        for s in sorted(links):
+            warnings.append("Link %s specified only in %s" % (s,links[s]))
+        return(warnings)
+
+    def out_edges(self, name):
+        """Return list of (kind, label, dst) for edges out of node name
+
+        The kind is 'link' (label is the rel), 'conneg' (label is the
+        content type), 'html_link' or 'html_img' (label is None).
+        """
+        node = self.nodes[name]
+        edges = [('link', rel, dst) for (rel, dst, mime_type) in node.links]
+        conneg = node.conneg
+        for content_type in sorted(conneg):
+            edges.append(('conneg', content_type, conneg[content_type][1]))
+        edges.extend(('html_link', None, dst) for dst in node.html_links)
+        edges.extend(('html_img', None, dst) for dst in node.html_imgs)
+        return(edges)
+
+    def index_adjacency(self):
+        """Build self.adjacency and self.cycles for traversal of the graph
+
+        self.adjacency has, for each node name, a tuple of the names of
+        the nodes that a client following Link headers, conneg redirects
+        and HTML links and imgs from it can get to in one step. The
+        cycles are found once here, see find_cycles().
+        """
+        self.adjacency = {}
+        for name in self.nodes:
+            dsts = []
+            seen = set()
+            for (kind, label, dst) in self.out_edges(name):
+                if (dst not in seen):
+                    seen.add(dst)
+                    dsts.append(dst)
+            self.adjacency[name] = tuple(dsts)
+        self.cycles = self.find_cycles()
+
+    def reachable(self, start):
+        """Return dict of name to (distance, previous) for nodes reachable from start
+
+        Breadth-first from start so that following previous back to start
+        gives a shortest path. Includes start, at distance 0.
+        """
+        reach = {start: (0, None)}
+        queue = collections.deque([start])
+        while (queue):
+            name = queue.popleft()
+            distance = reach[name][0] + 1
+            for dst in self.adjacency.get(name, ()):
+                if (dst not in reach):
+                    reach[dst] = (distance, name)
+                    queue.append(dst)
+        return(reach)
+
+    def shortest_path(self, start, end, reach=None):
+        """Return shortest path from start to end, None if not reachable
+
+        The path is a list of (src, kind, label, dst) steps, see
+        out_edges(). reach is the result of reachable(start) if already
+        known.
+        """
+        if (reach is None):
+            reach = self.reachable(start)
+        if (end not in reach):
+            return(None)
+        steps = []
+        while (end != start):
+            src = reach[end][1]
+            for (kind, label, dst) in self.out_edges(src):
+                if (dst == end):
+                    steps.append((src, kind, label, dst))
+                    break
+            end = src
+        steps.reverse()
+        return(steps)
+
+    def find_cycles(self):
+        """Return sorted list of cycles, each a sorted list of node names
+
+        Each cycle is a strongly connected component of more than one
+        node, or a single node that links to itself. Uses an iterative
+        version of Tarjan's algorithm so that large graphs do not hit
+        the recursion limit.
+        """
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        cycles = []
+        for root in sorted(self.adjacency):
+            if (root in index):
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, 0)]
+            while (work):
+                (name, j) = work[-1]
+                dsts = self.adjacency[name]
+                if (j < len(dsts)):
+                    work[-1] = (name, j + 1)
+                    dst = dsts[j]
+                    if (dst not in index):
+                        index[dst] = low[dst] = len(index)
+                        stack.append(dst)
+                        on_stack.add(dst)
+                        work.append((dst, 0))
+                    elif (dst in on_stack):
+                        low[name] = min(low[name], index[dst])
+                    continue
+                work.pop()
+                if (work):
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[name])
+                if (low[name] == index[name]):
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if (member == name):
+                            break
+                    if (len(component) > 1 or name in dsts):
+                        cycles.append(sorted(component))
+        cycles.sort()
+        return(cycles)
+
+    def paths_summary(self):
+        """Return data describing the link structure of the whole graph
+
+        Has the edges out of each node, the entry points (nodes that no
+        other node links to) and the cycles.
+        """
+        linked_to = set()
+        for name in self.adjacency:
+            linked_to.update(dst for dst in self.adjacency[name] if dst != name)
+        edges = {}
+        for name in self.nodes:
+            edges[name] = [list(edge) for edge in self.out_edges(name)]
+        return({'graph': self.name,
+                'edges': edges,
+                'entry_points': sorted(n for n in self.nodes if n not in linked_to),
+                'cycles': self.cycles})
+
+    def paths_from(self, start):
+        """Return data describing what can be reached from node start
+
+        Has, for each reachable node, the distance and a shortest path
+        as a list of [src, kind, label, dst] steps, and the cycles that
+        can be reached.
+        """
+        reach = self.reachable(start)
+        # Extend the path to the previous node, in order of distance
+        paths = {start: []}
+        edges = {}
+        for name in sorted(reach, key=lambda n: reach[n][0]):
+            src = reach[name][1]
+            if (src is None):
+                continue
+            if (src not in edges):
+                edges[src] = {}
+                for (kind, label, dst) in reversed(self.out_edges(src)):
+                    edges[src][dst] = [src, kind, label, dst]
+            paths[name] = paths[src] + [edges[src][name]]
+        reachable = {}
+        for name in reach:
+            reachable[name] = {'distance': reach[name][0], 'path': paths[name]}
+        return({'graph': self.name,
+                'from': start,
+                'reachable': reachable,
+                'cycles': [c for c in self.cycles if c[0] in reach]})
+
+    def to_data(self):
+        """Return the derived node model as plain data for caching
+
+        The pydot graph is not included.
+        """
+        nodes = []
+        for name in sorted(self.nodes):
+            n = self.nodes[name]
+            nodes.append([n.name, n.mime_type, n.conneg, n.links, n.html_links, n.html_imgs])
+        return({'name': self.name, 'nodes': nodes})
+
+    def from_data(self, data, file=None):
+        """Set graph from plain data returned by to_data() for file
+
+        The SVG file is looked for again as it may have changed.
+        """
+        self.g = None
+        self.name = data['name']
+        self.nodes = {}
+        self.node_names = None
+        self.symbols = Symbols()
+        for (name, mime_type, conneg, links, html_links, html_imgs) in data['nodes']:
+            n = Node(name, self.symbols)
+            name = n.name
+            n.mime_type = mime_type
+            n.conneg = conneg
+            n.links = links
+            n.html_links = html_links
+            n.html_imgs = html_imgs
+            self.nodes[name] = n
+        self.file = file
+        self.svg = None
+        if (file is not None):
+            self.mtime = os.path.getmtime(file)
             svg_file = os.path.splitext(file)[0] + '.svg'
             if (os.path.exists(svg_file)):
-                self.svg=svg_file
+                self.svg = svg_file
+        self.index_fragments()
+        self.index_adjacency()
+        self.sorted_node_names()
 
     def add_node(self, node_name):
         """Normalize name and add if not already present, return normalized name
         """
         node_name = self.normalize_name(node_name)
         if (node_name not in self.nodes):
-            self.nodes[node_name] = Node(node_name)
-            self.log.info(" Added node %s" % (node_name))
-            # A little fudging to infer type from name
-            if (re.search('(HTML|Splash|Choice)', node_name, re.I)):
-                self.nodes[node_name].mime_type = "text/html"
-            elif (re.search('PDF', node_name, re.I)):
-                self.nodes[node_name].mime_type = "application/pdf"
-            elif (re.search('RDF', node_name, re.I)):
-                self.nodes[node_name].mime_type = "text/turtle"
-            elif (re.search('IMG', node_name, re.I)):
-                self.nodes[node_name].mime_type = "image/png"
+            node_name = self.symbols.intern(node_name)
+            self.nodes[node_name] = Node(node_name, self.symbols)
+            self.node_names = None
+            self.log.info(" Added node %s", node_name)
+            self.nodes[node_name].mime_type = self.mime_type_rules(node_name)
         else:
-            self.log.info(" Already have node %s" % (node_name))
+            self.log.info(" Already have node %s", node_name)
         return(self.nodes[node_name])
 
+    def sorted_node_names(self):
+        """Return list of node names in sorted order
+
+        The list is built once after the graph is loaded and kept until
+        a node is added, so that index pages do not sort on each render.
+        """
+        if (self.node_names is None):
+            self.node_names = sorted(self.nodes)
+        return(self.node_names)
+
     def normalize_name(self, name):
         """Normalize a node name in pydot data
 
         Remove quotes, convert spaces and newlines to underscore
         """
-        name = re.sub( r'"', '', name )
-        name = re.sub( r'(\s|\\n)+', '_', name )
-        return(name)
+        return(self.name_space_re.sub('_', name.replace('"', '')))
 
     def normalize_label(self, name):
         """Normalize name in pydot data
 
         Remove quotes, convert return to space
         """
-        name = re.sub( r'"', '', name )
-        name = re.sub( r'\\n', ' ', name )
-        return(name)
+        return(name.replace('"', '').replace('\\n', ' '))
 
     def __str__(self):
+        if (self.g is None):
+            return "digraph %s (loaded from cache)" % (self.name)
         return self.g.to_string()
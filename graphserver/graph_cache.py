@@ -0,0 +1,102 @@
+"""On-disk cache of parsed graphs
+
+Parsing large .dot files is slow, so the derived node model of
+each graph (see Graph.to_data()) is saved in a cache directory keyed
+by a hash of the .dot file content. Unchanged files are then loaded
+from the cache without parsing.
+
+The cache files are JSON, a file that cannot be read or does not
+hold the data expected is treated as not in the cache.
+
+Simeon Warner, 2015
+"""
+
+import hashlib
+import json
+import logging
+import os
+import os.path
+import tempfile
+from graphserver.graph import Graph
+
+class GraphCache(object):
+
+    """Cache of parsed graphs in directory cache_dir"""
+
+    # Change if the Graph.to_data() format or parsing rules change
+    version = 3
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.log = logging.getLogger('graph_cache')
+
+    def key(self, dot_file):
+        """Return cache key for dot_file, based on content
+
+        The MIME type inference rules, edge label rules and parser are
+        included as they change the parsed graph.
+        """
+        label_rules = [(pattern.pattern, pattern.flags, method)
+                       for (pattern, method) in Graph.edge_label_rules]
+        h = hashlib.sha1("graphserver-graph-cache-v%d\n%r\n%r\n%r\n" %
+                         (self.version, Graph.mime_type_rules, label_rules, Graph.parser))
+        with open(dot_file, 'rb') as fh:
+            h.update(fh.read())
+        return(h.hexdigest())
+
+    def cache_file(self, key):
+        return(os.path.join(self.cache_dir, key + '.json'))
+
+    def load(self, dot_file):
+        """Return Graph for dot_file, from cache if possible
+
+        Graphs not in the cache are parsed and then added to it.
+        """
+        key = self.key(dot_file)
+        cache_file = self.cache_file(key)
+        try:
+            with open(cache_file, 'rb') as fh:
+                data = json.load(fh)
+            g = Graph()
+            g.from_data(str_data(data), dot_file)
+            self.hits += 1
+            self.log.info("Loaded %s from cache %s" % (dot_file, cache_file))
+            return(g)
+        except IOError:
+            self.misses += 1
+        except Exception as e:
+            # Corrupt or of another format, parse again and replace
+            self.misses += 1
+            self.log.warn("Ignoring bad graph cache file %s: %s" % (cache_file, str(e)))
+        g = Graph()
+        g.parse(dot_file)
+        self.save(key, g)
+        return(g)
+
+    def save(self, key, graph):
+        """Write data for graph to cache file for key"""
+        try:
+            data = json.dumps(graph.to_data(), separators=(',', ':'))
+            if (not os.path.isdir(self.cache_dir)):
+                os.makedirs(self.cache_dir)
+            (fd, tmp) = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.rename(tmp, self.cache_file(key))
+        except (IOError, OSError, UnicodeDecodeError) as e:
+            self.log.warn("Failed to write graph cache: %s" % (str(e)))
+
+def str_data(data):
+    """Return data from JSON with unicode strings encoded as UTF-8 str
+
+    Graphs parsed from .dot files have str names, labels and types.
+    """
+    if (isinstance(data, unicode)):
+        return(data.encode('utf-8'))
+    elif (isinstance(data, list)):
+        return([str_data(d) for d in data])
+    elif (isinstance(data, dict)):
+        return(dict((str_data(k), str_data(v)) for (k, v) in data.items()))
+    return(data)
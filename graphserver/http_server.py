@@ -6,23 +6,33 @@ the graph patterns requested.
 
 __all__ = ["SimpleHTTPRequestHandler"]
 
-from negotiator import ContentNegotiator, AcceptParameters, ContentType, Language
+import json
+import logging
 import os
 import posixpath
+import re
 import SimpleHTTPServer
+import time
 import urllib
-import urlparse
-import cgi
-import re
-
-class NotFound(Exception):
-    pass
+from graphserver.renderer import NotFound, coalesce
+from graphserver.response_cache import Response
 
 class GSHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
 
     """Simple HTTP request handler to simulate graphs
 
-    Implements HTTP GET and HEAD commands.
+    Implements HTTP GET and HEAD commands. All responses, including
+    the compressed variants selected by Accept-Encoding, are taken from
+    the precompiled ResponseCache in the class variable cache. It is
+    read once for each request, so a cache installed by a reload is
+    used from the next request, also on a keep-alive connection. POST is
+    supported only for the bulk /graph/_resolve API, see do_resolve().
+
+    If self.metrics (a graphserver.metrics.Metrics) is set then the
+    time taken by each phase of every request, and its status, are
+    recorded and served at /_metrics. If self.profiler (a
+    graphserver.metrics.SampledProfiler) is set then a sample of
+    requests is profiled.
     """
 
     # Class variables used for a number of configurations used each
@@ -30,328 +40,355 @@ class GSHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
     server_version = "SimpleHTTP+graphserver/0.000...1"
     base_uri = "http://unknown_base_uri/"
     #protocol_version ... HTTP protocol, no need to override
-    #graphs ... set of graphs to support
-
-    def do_GET(self, include_content=True):
-        """Serve a GET request (or HEAD by truncating)
+    #cache ... ResponseCache compiled from the graphs, replaced on reload
+    max_resolve_size = 10*1024*1024 #largest body accepted by _resolve
+    disable_nagle_algorithm = True #else writes over 8KB wait for delayed ACK
+    timeout = 30 #seconds, idle keep-alive connections are closed after this
+    resolve_path_re = re.compile(r'^/([^/]+)/_resolve$')
+    metrics = None #Metrics to record requests in, None to not record
+    profiler = None #SampledProfiler to profile requests, None to not profile
+    log = logging.getLogger('http_server')
+
+    def do_GET(self):
+        """Serve a GET request
         
-        The HEAD response is identical to GET except that no
-        content is sent, could be optimized.
+        Conditional requests with If-None-Match or If-Modified-Since
+        get a 304 response if not modified.
         """
-        # Defaults to build response
-        self.code=200
-        self.response_headers=[]
-        self.content=''
-        try:
-            self.set_headers_content(self.path)
-        except NotFound as e:
-            self.send_error(404)
-            return
-        except Exception as e:
-            self.send_error(500, "SERVER ERROR: " + str(e))
-            return        
-        # Have content, send HEAD or full GET
-        self.send_response(self.code)
-        self.send_head(self.response_headers,len(self.content))
-        if (include_content and self.content):
-            self.wfile.write(self.content)
+        self.handle_request(self.serve, True)
 
     def do_HEAD(self):
         """Serve a HEAD request
 
-        All this does is call do_GET with include_content=False to do
-        everything except actually sending the content
+        The status and all headers, including Link headers and
+        Content-Length, are precomputed in the Response so no content
+        is generated, read or copied to answer a HEAD request.
         """
-        self.do_GET(include_content=False)
+        self.handle_request(self.serve, False)
+
+    def handle_request(self, func, *args):
+        """Handle request by calling func(*args), recording metrics and profiling
 
-    def do_conneg(self,node):
-        """Specify the default parameters. These are the parameters which will be used in place of any HTTP Accept headers which are not present in the negotiation request. For example, if the Accept-Language header is not passed to the negotiator it will assume that the client request is for "en"
+        The phases route, conneg and body are timed where they happen,
+        write is the remainder of the time taken by the request.
         """
-        # Configure conneg and work out default from node config
-        acceptable=[]
-        default_content_type=None
-        for content_type in node.conneg:
-            (code,dst,default) = node.conneg[content_type]
-            self.log_message("conneg: config %s (%d,%s,%s)" % (content_type,code,dst,default))
-            acceptable.append(AcceptParameters(ContentType(content_type)))
-            if (default):
-                default_content_type=content_type
-        # If there was no default, pick the last one we saw
-        if (not default_content_type):
-            default_content_type=content_type
-        # Do we have an Accept header in the request? If not then default
-        if ('Accept' not in self.headers):
-            return(default_content_type)
-        # else conneg...
-        default_params = AcceptParameters(ContentType(default_content_type))
-        cn = ContentNegotiator(default_params, acceptable)
-        accept = self.headers["Accept"]
-        self.log_message("conneg: request Accept: %s" % (accept))
-        selected = cn.negotiate(accept)
-        #self.log_message("conneg: match %s" % (str(selected)))
-        if (selected is not None and
-            str(selected.content_type) in node.conneg):
-            self.log_message("conneg: selected %s" % (selected.content_type))
-            (code,dst,default) = node.conneg[str(selected.content_type)]
+        self.status = None
+        self.route_seconds = 0.0
+        self.conneg_seconds = 0.0
+        self.body_seconds = 0.0
+        start = time.time()
+        if (self.profiler is not None):
+            self.profiler.call(func, *args)
         else:
-            self.log_message("conneg: defaulting to %s" % (default_content_type))
-            (code,dst,default) = node.conneg[default_content_type]
-        self.code = code
-        self.response_headers.append(['Location',self.full_uri(dst)])
-        self.log_message("conneg: %d redirect to %s" % (code,dst))
+            func(*args)
+        if (self.metrics is not None):
+            duration = time.time() - start
+            (graph, node) = self.metrics_labels()
+            write_seconds = duration - self.route_seconds - self.conneg_seconds - self.body_seconds
+            self.metrics.record(graph, node, self.status, duration,
+                                [('route', self.route_seconds), ('conneg', self.conneg_seconds),
+                                 ('body', self.body_seconds), ('write', write_seconds)])
+
+    def metrics_labels(self):
+        """Return (graph, node) names for metrics of this request
+
+        Either is '' if the request path is not in a loaded graph or
+        not for a node, so that requests for arbitrary paths do not
+        add counters.
+        """
+        parts = urllib.unquote(self.path.split('?',1)[0].split('#',1)[0]).split('/')
+        graph = self.__class__.cache.graphs.get(parts[1]) if (len(parts) > 1) else None
+        if (graph is None):
+            return(('', ''))
+        return((graph.name, parts[2] if (len(parts) == 3 and parts[2] in graph.nodes) else ''))
+
+    def serve(self, include_content=True):
+        """Send Response for GET or HEAD request, content only if include_content"""
+        response = self.get_response(self.__class__.cache)
+        if (response is not None):
+            self.send_compiled(response, include_content)
+
+    def get_response(self, cache):
+        """Return Response for this request from cache, else send error and return None
+        """
+        start = time.time()
+        try:
+            response = self.find_response(cache, self.path, self.headers.get('Accept'))
+            response = cache.select_encoding(response, self.headers.get('Accept-Encoding'))
+            self.route_seconds = time.time() - start - self.conneg_seconds
+            return(response)
+        except NotFound as e:
+            self.send_error(404)
+        except Exception as e:
+            self.send_error(500, "SERVER ERROR: " + str(e))
+        return(None)
+
+    def do_conneg(self, cache, resource, accept=None):
+        """Select the Response for a ConnegResource based on Accept header accept
 
-    def set_headers_content(self,path):
+        With no Accept header (accept None) there is no redirect. Otherwise
+        the result of negotiation is memoized in cache.negotiated keyed
+        by resource path and normalized Accept header.
+        """
+        # Do we have an Accept header in the request? If not then no redirect
+        if (accept is None):
+            return(resource.variants[None])
+        # else conneg...
+        start = time.time()
+        accept = cache.normalize_accept(accept)
+        key = (resource.path, accept)
+        response = cache.negotiated.get(key)
+        if (response is None):
+            negotiated = cache.negotiated
+            self.log.info("conneg: request Accept: %s (cache %d hits, %d misses)",
+                          accept, negotiated.hits, negotiated.misses)
+            content_type = resource.negotiate(accept)
+            self.log.info("conneg: selected %s", content_type)
+            response = resource.variants[content_type]
+            negotiated.put(key, response)
+        if (self.log.isEnabledFor(logging.INFO)):
+            self.log.info("conneg: %d redirect to %s", response.code, dict(response.headers).get('Location'))
+        self.conneg_seconds += time.time() - start
+        return(response)
+
+    def find_response(self, cache, path, accept=None):
         """Path may be either index or a defined resource
 
         Paths supported have the forms:
            /                index
+           /?q=..&page=..   page of index, see ResponseCache.lookup_index()
+           /graph           index of graph
            /graph/resource  resource withing graph
-
-        Either returns content for the page or raises and exception.
+           /graph/svg       SVG image of graph
+           /graph/_paths    link structure of graph (JSON)
+           /graph/_paths/resource  what can be reached from resource (JSON)
+           /_admin/graphs   load status of graphs (JSON)
+           /_metrics        request metrics (Prometheus text format)
+
+        Either returns the precompiled Response in cache for the path, selected
+        by Accept header accept (None if there is no Accept header) for
+        conneg resources, or raises NotFound.
         """
-        # abandon query and fragment parameters
-        path = path.split('?',1)[0]
+        # abandon fragment, and query parameters except for the index
         path = path.split('#',1)[0]
+        (path, sep, query) = path.partition('?')
         path = posixpath.normpath(urllib.unquote(path))
-        words = path.split('/')[1:] # discard first word as empty
-        # Top-level index page?
-        if (path == '/'):
-            self.index_page()
-        elif (len(words)==1 and
-            words[0] in self.graphs):
-            self.graph_index_page(self.graphs[words[0]])
-        # CSS?
-        elif (path == '/css/graphserver.css'):
-            self.read_file('.'+path)
-        # Known graph?
-        elif (len(words)==2 and
-              words[0] in self.graphs):
-            graph = self.graphs[words[0]]
-            # Known resource in graph? or SVG image?
-            if (words[1] in self.graphs[words[0]].nodes):
-                self.build_node(graph, graph.nodes[words[1]])
-            elif (words[1]=='svg'):
-                self.read_and_link_svg(graph.svg, graph)
-        else:
-            raise NotFound
-
-    def send_head(self,headers,length=None):
-        """Common code for GET and HEAD commands.
-
-        This sends the HTTP headers and adds a Content-Length header based
-        on length.
-        """
-        for header in headers:
-            (name,value) = header
-            self.send_header(name, value)
-        if (length is not None):
-            self.send_header("Content-Length", length)
-        self.send_header("Last-Modified", self.date_time_string())
-        self.end_headers()
-
-    def index_page(self):
-        """Sets content for top-level index page
+        if (query and path == '/'):
+            return(cache.lookup_index(query))
+        if (path == '/_metrics' and self.metrics is not None):
+            return(self.metrics_response(cache))
+        # Resource that supports conneg?
+        if (path in cache.conneg):
+            return(self.do_conneg(cache, cache.conneg[path], accept))
+        return(cache.lookup(path))
+
+    def metrics_response(self, cache):
+        """Return Response with self.metrics and statistics of cache"""
+        gauges = [('graphserver_graphs', 'Number of graphs loaded.', len(cache.graphs)),
+                  ('graphserver_responses', 'Number of precompiled responses and conneg resources.',
+                   len(cache.responses) + len(cache.conneg))]
+        caches = [('conneg', cache.negotiated), ('accept_encoding', cache.accepted),
+                  ('node_paths', cache.node_paths), ('index_pages', cache.index_pages)]
+        return(Response(200, [['Content-Type', 'text/plain; version=0.0.4'], ['Cache-Control', 'no-cache']],
+                        self.metrics.prometheus(gauges, caches)))
+
+    def do_POST(self):
+        """Serve a POST request, only POST /graph/_resolve is supported
         """
-        content = "<html>\n<head>\n"
-        content += "<title>Signposting test server</title>\n"
-        content += '<link rel="stylesheet" href="/css/graphserver.css">\n</head>\n'
-        content += "<body>\n<h1>Signposting test server</h1>\n\n"
-        for graph_name in self.graphs:
-            graph = self.graphs[graph_name]
-            egn = cgi.escape(graph_name)
-            content += '<h3><a href="/%s/">Scenario: %s</a></h3>\n\n' % (egn,egn)
-            if (graph.svg):
-                content += "<a href=\"/%s/svg\"/>svg</a>\n" % (egn)
-            content += '<ul>\n'
-            for node_name in sorted(graph.nodes):
-                n = graph.nodes[node_name]
-                enn = cgi.escape(n.name)
-                content += "<li><a href=\"/%s/%s\">%s</a></li>\n" % (egn,enn,enn)
-            content += "</ul>\n\n"
-        content += "</body>\n</html>\n"
-        self.content = content
-
-    def graph_index_page(self, graph):
-        """Sets content for top-level index page
-        """
-        content = "<html>\n<head>\n"
-        content += "<title>Signposting test server - %s</title>\n" % (graph.name)
-        content += '<link rel="stylesheet" href="/css/graphserver.css">\n</head>\n'
-        egn = cgi.escape(graph.name)
-        content += '<body>\n<h1>Scenario: %s</h1>\n\n' % (egn)
-        if (graph.svg):
-            content += '<object type="image/svg+xml" data="/%s/svg">Your browser does not support SVG</object>\n' % (graph.name)
-        content += '<ul>\n'
-        for node_name in sorted(graph.nodes):
-            n = graph.nodes[node_name]
-            enn = cgi.escape(n.name)
-            content += "<li><a href=\"/%s/%s\">%s</a></li>\n" % (egn,enn,enn)
-        content += "</ul>\n\n"
-        content += "</body>\n</html>\n"
-        self.content = content
-
-    def build_node(self, graph, node):
-        """Set code, headers and content for resource
-        """
-        dump = self.node_info(node)
-        if (node.mime_type):
-            self.response_headers.append(['Content-Type',node.mime_type])
-        # Is this a node that supports conneg?
-        if (node.conneg):
-            self.do_conneg(node)
-        if (node.mime_type == 'text/html'):
-            self.content="<html>\n<head>\n<title>%s</title>\n" % (node.name)
-            self.content+='<link rel="stylesheet" href="/css/graphserver.css">\n</head>\n'
-            self.content+="<body>\n<h1>%s</h1>\n" % (node.name)
-            self.content+=self.node_html_links_imgs(node)
-            self.content+="<pre>\n"
-            self.content+=self.node_info(node)
-            self.content+="</pre>\n"
-            # Any fragments to deal with?
-            for name2 in graph.nodes:
-                m = re.match(node.name+"#(.+)",name2)
-                if (m):
-                    frag = m.group(1)
-                    frag_node = graph.nodes[name2]
-                    self.content+="<h2><a id=\"%s\">Fragment #%s</a></h2>\n" % (frag,frag)
-                    self.content+=self.node_html_links_imgs(frag_node)
-                    self.content+="<pre>\n"
-                    self.content+=self.node_info(frag_node)
-                    self.content+="</pre>\n"
-                    self.content+=self.check_frag_against_parent(frag_node, node)
-            self.content+="</body></html>\n"
-        elif (node.mime_type=='image/png'):
-            self.read_file('examples/png.png')
-        elif (node.mime_type=='application/pdf'):
-            self.read_file('examples/pdf.pdf')
-        elif (node.mime_type=='text/turtle'):
-            self.build_turtle(node)
-        else: #assume text/plain
-            self.content=self.node_info(node)
-        for link in node.links:
-            (rel,dst,mime_type)=link
-            uri = self.full_uri(dst)
-            mime_type_str = ('; type="%s"' % (mime_type)) if (mime_type) else ''
-            self.response_headers.append(['Link','<%s>; rel="%s"%s' % (uri,rel,mime_type_str)])
-
-    def node_info(self, node):
-        """Return preformatted node information string"""
-        info =  "name: %s\n" % node.name
-        info += "mime_type: %s\n" % str(node.mime_type)
-        info += "conneg: %s\n" % str(node.conneg)
-        info += "links: %s\n" % str(node.links)
-        #info += "html_links: %s\n" % str(node.html_links)
-        #info += "html_imgs: %s\n" % str(node.html_imgs)
-        return(info)
-
-    def node_html_links_imgs(self, node):
-        """Return HTML for included links and imgs"""
-        return( self.node_html_links(node) + self.node_html_imgs(node) )
-
-    def node_html_imgs(self, node):
-        """Return HTML <ul> list of img links for this node"""
-        html = ''
-        for img in node.html_imgs:
-             html += "<li><a href=\"%s\">%s</a></li>\n" % (img,img)
-        if (html):
-            return("<p>Images included:</p>\n<ul>\n"+html+"</ul>\n")
-        else:
-            return("")        
-
-    def node_html_links(self, node):
-        """Return HTML <ul> list of HTML links for this node"""
-        html = ''
-        for dst in node.html_links:
-             html += "<li><a href=\"%s\">%s</a></li>\n" % (dst,dst)
-        if (html):
-            return("<p>Links to:</p>\n<ul>\n"+html+"</ul>\n")
-        else:
-            return("")
-
-    def check_frag_against_parent(self, frag_node, parent_node):
-        """Check to see whether frag node is compatible with parent
-
-        Returns HTML warnings if note, blank if OK
+        self.handle_request(self.serve_post)
+
+    def serve_post(self):
+        """Serve POST /graph/_resolve, else send an error"""
+        cache = self.__class__.cache
+        path = posixpath.normpath(urllib.unquote(self.path.split('?',1)[0]))
+        m = self.resolve_path_re.match(path)
+        if (not m):
+            self.send_error(405)
+            return
+        graph_name = m.group(1)
+        if (graph_name not in cache.graph_paths):
+            self.send_error(404)
+            return
+        if ('Content-Length' not in self.headers):
+            self.send_error(411)
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            self.send_error(400, "Bad Content-Length")
+            return
+        if (length > self.max_resolve_size):
+            self.send_error(413)
+            return
+        body = self.rfile.read(length)
+        try:
+            probes = self.resolve_probes(cache, graph_name, body)
+        except ValueError as e:
+            self.send_error(400, "Bad _resolve request: " + str(e))
+            return
+        self.do_resolve(cache, probes)
+
+    def resolve_probes(self, cache, graph_name, body):
+        """Return list of (path, accept) to resolve from _resolve request body
+
+        The body is a JSON array, or JSON lines, of items that are either
+        a path or an object {"path": path, "accept": accept} where accept
+        is an Accept header value, a list of them, or null for no Accept
+        header (the default). Paths not starting with / are relative to
+        the graph. An empty body probes every resource in the graph, with
+        no Accept header and with the Accept header of each conneg type.
+        Raises ValueError if the body is not valid.
         """
-        warnings = []
-        # mime_types should be the same
-        if (frag_node.mime_type != parent_node.mime_type):
-            warnings.append("MIME type mismatch: %s vs %s" %
-                            (frag_node.mime_type, parent_node.mime_type))
-        # links should be the same
-        links = {}
-        for l in frag_node.links:
-            links[str(l)]='fragment'
-        for l in parent_node.links:
-            s=str(l)
-            if (s in links):
-                links.delete(s);
+        if (not body.strip()):
+            probes = []
+            for path in sorted(cache.graph_paths[graph_name]):
+                probes.append((path, None))
+                if (path in cache.conneg):
+                    for content_type in sorted(cache.conneg[path].variants):
+                        if (content_type is not None):
+                            probes.append((path, content_type))
+            return(probes)
+        try:
+            items = json.loads(body)
+        except ValueError:
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        if (isinstance(items, dict)):
+            items = [items]
+        if (not isinstance(items, list)):
+            raise ValueError("expected array of paths or objects")
+        base = '/' + graph_name + '/'
+        probes = []
+        for item in items:
+            if (isinstance(item, dict)):
+                (path, accept) = (item.get('path'), item.get('accept'))
             else:
-                links[s]='parent'
-        for s in sorted(links):
-            warnings.append("Link %s specified only in %s" % (s,links[s]))
-        if (warnings):
-            return "<p class=\"error\">WARNINGS:<br/>" + "<br/>\n".join(warnings) + "</p>\n"
-        else:
-            return ""
-
-    def read_and_link_svg(self, file, graph):
-        """ Read SVG and mark up all nodes as links to resources in graph
-
-        This is a svg-scrape fudge and relies upon the formatting of the
-        svg output from dot. Likely fragile... but expedient ;-)
+                (path, accept) = (item, None)
+            if (not isinstance(path, basestring)):
+                raise ValueError("bad path %r" % (path,))
+            path = posixpath.join(base, path.encode('utf-8'))
+            accepts = accept if (isinstance(accept, list)) else [accept]
+            for accept in accepts:
+                if (accept is not None and not isinstance(accept, basestring)):
+                    raise ValueError("bad accept %r" % (accept,))
+                probes.append((path, accept.encode('utf-8') if (accept is not None) else None))
+        return(probes)
+
+    def do_resolve(self, cache, probes):
+        """Send results of resolving each (path, accept) in probes against cache
+
+        The response is JSON lines, one object per probe with the path,
+        accept, and the status, Content-Type, Location and Link headers
+        that a GET would get. The results are computed as they are sent
+        and no content is rendered or read.
         """
+        lines = (json.dumps(self.resolve(cache, path, accept), sort_keys=True) + "\n"
+                 for (path, accept) in probes)
+        self.send_stream(200, "Content-Type: application/x-ndjson\r\n", coalesce(lines, 16384))
+
+    def resolve(self, cache, path, accept=None):
+        """Return dict describing the response to a GET of path from cache"""
+        result = {'path': path, 'accept': accept, 'status': 404,
+                  'content_type': None, 'location': None, 'links': []}
         try:
-            f = open(file,'r')
-        except Exception as e:
-            self.log_message("read_and_link_svg: Failed: %s" % (str(e)))
-            raise NotFound
-        self.content = ""
-        in_link = False 
-        for line in f:
-            m = re.match(r'<!-- ([^-]+) -->', line)
-            if (m):
-                if (in_link):
-                    in_link = False
-                    self.content += "</a>\n"
-                name = m.group(1)
-                name = re.sub(r'(\\n|\s+)', '_', name) #normalize
-                if (name in graph.nodes):
-                    in_link = True
-                    line += '<a xlink:href="/%s/%s">\n' % (graph.name, name)
-            self.content += line
-        f.close()
-
-    def read_file(self, file):
-        """Read specified into self.content
-
-        Depending on how much ends up being dynamically generated vs read in,
-        should perhaps pass file ptr to output routine instead, per standard
-        SimpleHTTPServer.
+            response = self.find_response(cache, path, accept)
+        except NotFound:
+            return(result)
+        result['status'] = response.code
+        for (name, value) in response.headers:
+            if (name == 'Link'):
+                result['links'].append(value)
+            elif (name == 'Location'):
+                result['location'] = value
+            elif (name == 'Content-Type'):
+                result['content_type'] = value
+        return(result)
+
+    def send_stream(self, code, head, chunks=None):
+        """Send response with head and content from iterable chunks
+
+        The content is sent as it is generated, with chunked transfer
+        encoding for HTTP/1.1 clients, otherwise by closing the
+        connection at the end. With chunks None (for HEAD) only the
+        status and headers are sent.
         """
-        try:
-            f = open(file,'r')
-            self.content = f.read()
-            f.close()
-        except Exception as e:
-            self.log_message("read_file: Failed: %s" % (str(e)))
-            raise NotFound       
+        if (chunks is not None):
+            chunks = self.timed(chunks)
+        if (self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1'):
+            head += "Transfer-Encoding: chunked\r\n"
+            if (chunks is not None):
+                chunks = self.chunked(chunks)
+        else:
+            head += "Connection: close\r\n"
+            self.close_connection = 1
+        self.write_head(code, head)
+        if (chunks is not None):
+            self.send_chunks(chunks)
+
+    def timed(self, chunks):
+        """Generator of chunks adding time taken to generate them to self.body_seconds"""
+        chunks = iter(chunks)
+        while True:
+            start = time.time()
+            try:
+                chunk = next(chunks)
+            finally:
+                self.body_seconds += time.time() - start
+            yield chunk
+
+    def chunked(self, chunks):
+        """Generator of chunks in chunked transfer encoding"""
+        for chunk in chunks:
+            if (chunk):
+                yield "%x\r\n%s\r\n" % (len(chunk), chunk)
+        yield "0\r\n\r\n"
+
+    def send_chunks(self, chunks):
+        """Write each of chunks to the client as it is generated"""
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def send_compiled(self, response, include_content=True):
+        """Send response, or 304 if the client's copy is current
+
+        The content is sent only if include_content is set. Streamed
+        responses are sent with chunked transfer encoding.
+        """
+        # Is client's copy current?
+        if (response.not_modified(self.headers.get('If-None-Match'),
+                                  self.headers.get('If-Modified-Since'))):
+            self.write_head(304, response.not_modified_head)
+            return
+        if (response.stream is not None):
+            self.send_stream(response.code, response.head,
+                             response.stream() if (include_content) else None)
+            return
+        self.write_head(response.code, response.head,
+                        response.body if (include_content) else '')
+        if (include_content and response.asset is not None):
+            self.send_asset(response.asset)
 
-    def build_turtle(self, node):
-        """Make a turtle description of this node in self.content
+    def write_head(self, code, head, content=''):
+        """Write status line, headers and content in one operation
 
-        Just a dummy version of the node info for amusement
+        Adds the Server and Date headers to the precompiled head as
+        send_response() would, but without a write for each header.
         """
-        turtle =  "@prefix dc: <http://purl.org/dc/elements/1.1/> .\n"
-        turtle += "@prefix x: <http://example.org/terms/> .\n\n"
-        turtle += '[ dc:title    "%s" ;\n' % node.name
-        turtle += '  x:mime_type "%s" ;\n' % str(node.mime_type)
-        turtle += '  x:conneg    "%s" ;\n' % str(node.conneg)
-        turtle += '  x:links     "%s" ;\n' % str(node.links)
-        turtle += "] .\n"
-        self.content = turtle
-
-    def full_uri(self, relative_uri):
-        """Return full URI for relative_uri based on current request context"""
-        return urlparse.urljoin(self.base_uri+self.path, relative_uri)
+        self.log_request(code)
+        if (self.request_version == 'HTTP/0.9'):
+            self.wfile.write(content)
+            return
+        message = self.responses[code][0] if (code in self.responses) else ''
+        self.wfile.write("%s %d %s\r\nServer: %s\r\nDate: %s\r\n%s\r\n%s" %
+                         (self.protocol_version, code, message, self.version_string(),
+                          self.date_time_string(), head, content))
+
+    def log_request(self, code='-', size='-'):
+        """Log request and keep status code for metrics"""
+        self.status = code
+        SimpleHTTPServer.SimpleHTTPRequestHandler.log_request(self, code, size)
+
+    def send_asset(self, asset):
+        """Send content of a large static asset directly to the socket"""
+        self.wfile.flush()
+        asset.send_to(self.connection)
 
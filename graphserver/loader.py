@@ -0,0 +1,162 @@
+"""Loading and reloading of graphs from the .dot files in a directory
+
+Simeon Warner, 2015
+"""
+
+import glob
+import logging
+import os.path
+import threading
+import time
+from graphserver.graph import Graph
+
+class LoadedFile(object):
+
+    """Record of a .dot file and the graph loaded from it"""
+
+    def __init__(self, file, signature, graph, load_seconds):
+        self.file = file
+        self.signature = signature
+        self.graph = graph
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.loads = 1
+
+class GraphLoader(object):
+
+    """Load graphs from the *.dot files in base_dir, reloading changes
+
+    Each call to refresh() parses only the files that are new or have
+    changed (the .dot file or the .svg file alongside it) since the
+    last call and returns a new dict of graphs, so that a dict already
+    in use is never modified. If graph_cache (a GraphCache) is given
+    then graphs are loaded through it. A file that fails to load is
+    not tried again until it changes.
+    """
+
+    def __init__(self, base_dir, graph_cache=None):
+        self.base_dir = base_dir
+        self.graph_cache = graph_cache
+        self.files = {}
+        self.failed = {}
+        self.graphs = {}
+        self.log = logging.getLogger('loader')
+
+    def signature(self, dot_file):
+        """Return (dot mtime, svg mtime, dot size) for dot_file, None if missing"""
+        svg_file = os.path.splitext(dot_file)[0] + '.svg'
+        try:
+            mtime = os.path.getmtime(dot_file)
+            size = os.path.getsize(dot_file)
+        except OSError:
+            return(None)
+        svg_mtime = os.path.getmtime(svg_file) if (os.path.exists(svg_file)) else None
+        return((mtime, svg_mtime, size))
+
+    def refresh(self, progress=None, strict=False):
+        """Load new or changed files, return list of names of changed graphs
+
+        The names include those of graphs that have been removed. If
+        progress is given it is called with the name of each file before
+        it is parsed. With strict set a file that fails to load, or has
+        a duplicate graph name, raises an exception, otherwise it is
+        logged and any previously loaded version is kept.
+        """
+        files = {}
+        failed = {}
+        changed = set()
+        for dot_file in sorted(glob.glob("%s/*.dot" % self.base_dir)):
+            signature = self.signature(dot_file)
+            old = self.files.get(dot_file)
+            if (old is not None and old.signature == signature):
+                files[dot_file] = old
+                continue
+            if (self.failed.get(dot_file) == signature):
+                # Failed to load and not changed since
+                failed[dot_file] = signature
+                if (old is not None):
+                    files[dot_file] = old
+                continue
+            if (progress):
+                progress(dot_file)
+            try:
+                start = time.time()
+                if (self.graph_cache is not None):
+                    g = self.graph_cache.load(dot_file)
+                else:
+                    g = Graph()
+                    g.parse(dot_file)
+                loaded = LoadedFile(dot_file, signature, g, time.time() - start)
+            except Exception as e:
+                if (strict):
+                    raise
+                self.log.error("Failed to load %s: %s" % (dot_file, str(e)))
+                failed[dot_file] = signature
+                if (old is not None):
+                    files[dot_file] = old
+                continue
+            if (old is not None):
+                loaded.loads = old.loads + 1
+                changed.add(old.graph.name)
+            files[dot_file] = loaded
+            changed.add(g.name)
+        for dot_file in self.files:
+            if (dot_file not in files):
+                self.log.info("Removed %s" % (dot_file))
+                changed.add(self.files[dot_file].graph.name)
+        # Build new graphs dict, checking for duplicate names
+        graphs = {}
+        for dot_file in sorted(files):
+            g = files[dot_file].graph
+            if (g.name in graphs):
+                msg = "Duplicate graph name %s in file %s" % (g.name,dot_file)
+                if (strict):
+                    raise Exception(msg)
+                self.log.error(msg)
+                continue
+            graphs[g.name] = g
+        self.files = files
+        self.failed = failed
+        self.graphs = graphs
+        return(sorted(changed))
+
+    def status(self):
+        """Return list of dicts describing each loaded graph"""
+        status = []
+        for dot_file in sorted(self.files):
+            f = self.files[dot_file]
+            status.append({'name': f.graph.name,
+                           'file': dot_file,
+                           'nodes': len(f.graph.nodes),
+                           'mtime': f.signature[0],
+                           'load_seconds': round(f.load_seconds, 6),
+                           'loaded_at': f.loaded_at,
+                           'loads': f.loads})
+        return(status)
+
+class Reloader(threading.Thread):
+
+    """Thread that polls for changed .dot files and reloads them
+
+    When graphs change, on_reload is called with the loader and the
+    list of changed graph names.
+    """
+
+    def __init__(self, loader, on_reload, interval=2.0):
+        threading.Thread.__init__(self, name='reloader')
+        self.daemon = True
+        self.loader = loader
+        self.on_reload = on_reload
+        self.interval = interval
+        self.log = logging.getLogger('loader')
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                changed = self.loader.refresh()
+                if (changed):
+                    self.log.warn("Reloaded graphs: %s" % (', '.join(changed)))
+                    self.on_reload(self.loader, changed)
+            except Exception:
+                self.log.exception("Reload failed")
@@ -0,0 +1,154 @@
+"""Request metrics and profiling for graphserver
+
+Metrics counts requests by graph, node and status and accumulates the
+time taken by each phase of handling them, for export at /_metrics in
+the Prometheus text format. SampledProfiler runs cProfile on a sample
+of requests.
+
+Each process has its own metrics, so in prefork mode /_metrics gives
+those of the worker that handles the request.
+
+Simeon Warner, 2015
+"""
+
+import bisect
+import cProfile
+import os
+import threading
+import time
+
+def escape_label(value):
+    """Return value escaped for use as a Prometheus label value"""
+    return(str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+class Metrics(object):
+
+    """Request counters and timings, safe for use by several threads
+
+    The phases of a request are route (finding the response), conneg
+    (content negotiation), body (generating streamed content) and
+    write (sending the response). Requests are counted by graph, node
+    and status. To bound memory for very large graphs there are at
+    most max_series counters, requests for further nodes are counted
+    with node '_other'.
+    """
+
+    phases = ('route', 'conneg', 'body', 'write')
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+    max_series = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}
+        self.phase_seconds = dict((phase, 0.0) for phase in self.phases)
+        self.duration_counts = [0] * (len(self.buckets) + 1)
+        self.duration_sum = 0.0
+
+    def record(self, graph, node, status, duration, phase_seconds):
+        """Record request for node in graph with status taking duration seconds
+
+        phase_seconds is a list of (phase, seconds) for the phases of
+        the request.
+        """
+        bucket = bisect.bisect_left(self.buckets, duration)
+        key = (graph, node, status)
+        with self.lock:
+            if (key not in self.requests and len(self.requests) >= self.max_series):
+                key = (graph, '_other', status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for (phase, seconds) in phase_seconds:
+                self.phase_seconds[phase] += seconds
+            self.duration_counts[bucket] += 1
+            self.duration_sum += duration
+
+    def prometheus(self, gauges=(), caches=()):
+        """Return metrics in the Prometheus text format
+
+        gauges is a list of (name, help, value) for other values to
+        include, and caches a list of (name, LRUCache) for which the
+        hits and misses are included.
+        """
+        lines = []
+        def metric(name, kind, help):
+            lines.append("# HELP %s %s\n# TYPE %s %s\n" % (name, help, name, kind))
+        with self.lock:
+            requests = sorted(self.requests.items())
+            phase_seconds = dict(self.phase_seconds)
+            duration_counts = list(self.duration_counts)
+            duration_sum = self.duration_sum
+        metric('graphserver_requests_total', 'counter', 'Requests by graph, node and status.')
+        for ((graph, node, status), count) in requests:
+            lines.append('graphserver_requests_total{graph="%s",node="%s",status="%s"} %d\n' %
+                         (escape_label(graph), escape_label(node), escape_label(status), count))
+        metric('graphserver_request_phase_seconds_total', 'counter',
+               'Time spent in each phase of handling requests.')
+        for phase in self.phases:
+            lines.append('graphserver_request_phase_seconds_total{phase="%s"} %.6f\n' %
+                         (phase, phase_seconds[phase]))
+        metric('graphserver_request_duration_seconds', 'histogram', 'Time taken to handle requests.')
+        cumulative = 0
+        for (le, count) in zip(self.buckets + ('+Inf',), duration_counts):
+            cumulative += count
+            lines.append('graphserver_request_duration_seconds_bucket{le="%s"} %d\n' % (le, cumulative))
+        lines.append('graphserver_request_duration_seconds_sum %.6f\n' % (duration_sum))
+        lines.append('graphserver_request_duration_seconds_count %d\n' % (cumulative))
+        if (caches):
+            for suffix in ('hits', 'misses'):
+                metric('graphserver_cache_%s_total' % (suffix), 'counter',
+                       'Cache %s by cache.' % (suffix))
+                for (name, cache) in caches:
+                    lines.append('graphserver_cache_%s_total{cache="%s"} %d\n' %
+                                 (suffix, name, getattr(cache, suffix)))
+        for (name, help, value) in gauges:
+            metric(name, 'gauge', help)
+            lines.append('%s %s\n' % (name, value))
+        metric('graphserver_start_time_seconds', 'gauge', 'Time the metrics were started.')
+        lines.append('graphserver_start_time_seconds %.3f\n' % (self.started))
+        return(''.join(lines))
+
+class SampledProfiler(object):
+
+    """Profile one in every rate requests with cProfile
+
+    The statistics for all the sampled requests are accumulated and
+    written to file (with .PID added in processes other than the one
+    that created the profiler, such as prefork workers) every
+    dump_every samples and by dump(). Only one request is profiled at
+    a time, a sample that would overlap another is skipped.
+    """
+
+    dump_every = 100
+
+    def __init__(self, file, rate=100):
+        self.file = file
+        self.rate = max(1, rate)
+        self.pid = os.getpid()
+        self.profile = cProfile.Profile()
+        self.lock = threading.Lock()
+        self.count = 0
+        self.samples = 0
+
+    def call(self, func, *args):
+        """Call func(*args), profiled if this call is in the sample"""
+        self.count += 1
+        if (self.count % self.rate != 0 or not self.lock.acquire(False)):
+            return(func(*args))
+        try:
+            self.profile.enable()
+            try:
+                return(func(*args))
+            finally:
+                self.profile.disable()
+                self.samples += 1
+                if (self.samples % self.dump_every == 0):
+                    self.dump()
+        finally:
+            self.lock.release()
+
+    def dump(self):
+        """Write statistics of the samples so far to the profile file"""
+        if (self.samples == 0):
+            return
+        pid = os.getpid()
+        self.profile.dump_stats(self.file if (pid == self.pid) else "%s.%d" % (self.file, pid))
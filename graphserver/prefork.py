@@ -0,0 +1,389 @@
+"""Pre-fork multi-process HTTP server for graphserver
+
+The parent process has already parsed the graphs and compiled the
+responses before the server is started, so forked workers share
+them copy-on-write. Each worker is a threaded HTTP server that
+accepts on its own SO_REUSEPORT socket bound to the same address
+(the kernel distributes connections between them) or, where
+SO_REUSEPORT is not available, on a listening socket shared with
+the parent.
+
+Signals handled by the parent:
+
+  SIGHUP    graceful restart, workers are replaced one at a time: a
+            new worker is started and once it is accepting the old
+            one stops accepting, handles the connections already
+            queued on its socket, finishes its requests and exits
+  SIGUSR1   log health report for each worker
+  SIGTERM   stop workers and exit (also SIGINT)
+
+Workers send a heartbeat to the parent every heartbeat_interval
+seconds, workers that stop sending heartbeats are restarted.
+
+Simeon Warner, 2015
+"""
+
+import BaseHTTPServer
+import errno
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import time
+
+# Not defined in python2 socket module, values from Linux and BSD/OS X
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT',
+                       0x0200 if sys.platform == 'darwin' or 'bsd' in sys.platform else 15)
+
+def set_reuseport(sock):
+    """Set SO_REUSEPORT on sock, return True on success"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        return(True)
+    except (socket.error, OSError):
+        return(False)
+
+class PreforkWorkerHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """Threaded HTTP server run in each worker, counts requests"""
+
+    daemon_threads = True
+    requests_handled = 0
+
+    def process_request(self, request, client_address):
+        self.requests_handled += 1
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+class WorkerStatus(object):
+
+    """Parent's view of one worker process"""
+
+    def __init__(self, pid, pipe):
+        self.pid = pid
+        self.pipe = pipe
+        self.started = time.time()
+        self.last_heartbeat = self.started
+        self.requests = 0
+        self.active = 0
+        self.buffer = ''
+        self.ready = False
+        self.retiring = False
+
+    def as_dict(self):
+        return({'pid': self.pid,
+                'uptime': round(time.time() - self.started, 1),
+                'last_heartbeat': round(time.time() - self.last_heartbeat, 1),
+                'requests': self.requests,
+                'active': self.active})
+
+class PreforkHTTPServer(object):
+
+    """Parent of a set of pre-forked worker HTTP servers
+
+    Has the same constructor and serve_forever() interface as
+    BaseHTTPServer.HTTPServer. The number of worker processes is
+    set by the class variable workers.
+    """
+
+    workers = 4
+    heartbeat_interval = 2.0
+    heartbeat_timeout = 30.0
+    shutdown_grace = 10.0
+    request_queue_size = 128
+    status_file = None
+
+    def __init__(self, server_address, RequestHandlerClass):
+        self.RequestHandlerClass = RequestHandlerClass
+        self.log = logging.getLogger('prefork')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.reuseport = set_reuseport(self.socket)
+        self.socket.bind(server_address)
+        self.server_address = self.socket.getsockname()
+        if (not self.reuseport):
+            # Fall back to one listening socket inherited by all workers
+            self.log.warn("SO_REUSEPORT not available, workers share one socket")
+            self.socket.listen(self.request_queue_size)
+        self.children = {}
+        self.running = False
+        self.restart_queue = []
+        self.replacing = None
+        self.restart_pending = False
+        self.report_pending = False
+
+    def serve_forever(self):
+        """Start workers and supervise them until SIGTERM or SIGINT"""
+        self.running = True
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_restart)
+        signal.signal(signal.SIGUSR1, self.handle_report)
+        for n in range(self.workers):
+            self.spawn_worker()
+        try:
+            while (self.running):
+                self.read_heartbeats(0.1 if (self.restart_queue or self.replacing)
+                                     else self.heartbeat_interval)
+                self.reap_workers()
+                self.check_health()
+                if (self.restart_pending):
+                    self.restart_pending = False
+                    self.restart_workers()
+                self.step_restart()
+                if (self.report_pending):
+                    self.report_pending = False
+                    self.report()
+                self.write_status()
+        finally:
+            self.stop_workers()
+
+    def handle_stop(self, signum, frame):
+        self.running = False
+
+    def handle_restart(self, signum, frame):
+        self.restart_pending = True
+
+    def handle_report(self, signum, frame):
+        self.report_pending = True
+
+    def graceful_restart(self):
+        """Request graceful restart of workers, e.g. after graphs reloaded"""
+        self.restart_pending = True
+
+    def spawn_worker(self):
+        """Fork a new worker process, return its pid"""
+        (rfd, wfd) = os.pipe()
+        pid = os.fork()
+        if (pid == 0):
+            os.close(rfd)
+            for status in self.children.values():
+                os.close(status.pipe)
+            code = 0
+            try:
+                self.run_worker(wfd)
+            except Exception:
+                self.log.exception("Worker %d failed" % (os.getpid()))
+                code = 1
+            self.worker_exit()
+            os._exit(code)
+        os.close(wfd)
+        self.children[pid] = WorkerStatus(pid, rfd)
+        self.log.info("Started worker %d" % (pid))
+        return(pid)
+
+    def run_worker(self, wfd):
+        """Worker process: serve requests and send heartbeats on wfd"""
+        stopping = []
+        def stop(signum, frame):
+            stopping.append(signum)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        httpd = PreforkWorkerHTTPServer(self.server_address, self.RequestHandlerClass,
+                                        bind_and_activate=False)
+        if (self.reuseport):
+            self.socket.close()
+            httpd.allow_reuse_address = True
+            set_reuseport(httpd.socket)
+            httpd.server_bind()
+            httpd.server_activate()
+        else:
+            httpd.socket.close()
+            httpd.socket = self.socket
+        httpd.timeout = self.heartbeat_interval
+        last_heartbeat = 0
+        while (not stopping):
+            if (time.time() - last_heartbeat > self.heartbeat_interval / 2):
+                self.send_heartbeat(wfd, httpd)
+                last_heartbeat = time.time()
+            httpd.handle_request()
+        # Graceful stop: no new connections, let current requests finish
+        if (self.reuseport):
+            self.drain(httpd)
+        httpd.server_close()
+        deadline = time.time() + self.shutdown_grace
+        while (threading.active_count() > 1 and time.time() < deadline):
+            self.send_heartbeat(wfd, httpd)
+            time.sleep(0.1)
+
+    def drain(self, httpd):
+        """Handle the connections queued on the worker's own listening socket
+
+        With SO_REUSEPORT each worker has its own accept queue, the
+        connections in it would be dropped when the socket is closed.
+        They are accepted until there are none and then the caller
+        closes the socket at once, so that only a connection that
+        arrives between the two is lost.
+        """
+        httpd.socket.setblocking(0)
+        while True:
+            try:
+                (request, client_address) = httpd.get_request()
+            except socket.error as e:
+                if (e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                    break
+                if (e.args[0] == errno.EINTR):
+                    continue
+                raise
+            if (httpd.verify_request(request, client_address)):
+                httpd.process_request(request, client_address)
+            else:
+                httpd.shutdown_request(request)
+
+    def worker_exit(self):
+        """Clean up in worker before it exits
+
+        Workers exit with os._exit() so atexit functions are not run,
+        the profile of the requests the worker sampled (if any) is
+        written here, to a file with the pid of the worker added.
+        """
+        profiler = getattr(self.RequestHandlerClass, 'profiler', None)
+        if (profiler is not None):
+            try:
+                profiler.dump()
+            except (IOError, OSError) as e:
+                self.log.warn("Worker %d failed to write profile: %s" % (os.getpid(), str(e)))
+
+    def send_heartbeat(self, wfd, httpd):
+        """Send 'requests active' line to parent"""
+        try:
+            os.write(wfd, "%d %d\n" % (httpd.requests_handled, threading.active_count() - 1))
+        except OSError:
+            pass
+
+    def read_heartbeats(self, timeout):
+        """Wait up to timeout for heartbeats and record them"""
+        pipes = dict((status.pipe, status) for status in self.children.values())
+        try:
+            (readable, w, x) = select.select(pipes.keys(), [], [], timeout)
+        except select.error as e:
+            if (e.args[0] != errno.EINTR):
+                raise
+            return
+        for fd in readable:
+            status = pipes[fd]
+            try:
+                data = os.read(fd, 4096)
+            except OSError:
+                continue
+            if (not data):
+                continue # worker exited, will be reaped
+            status.buffer += data
+            lines = status.buffer.split("\n")
+            status.buffer = lines.pop()
+            if (lines):
+                status.ready = True
+                (requests, active) = lines[-1].split()
+                status.requests = int(requests)
+                status.active = int(active)
+                status.last_heartbeat = time.time()
+
+    def reap_workers(self):
+        """Collect exited workers and start replacements"""
+        while (self.children):
+            try:
+                (pid, exit_status) = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if (e.errno == errno.EINTR):
+                    continue
+                break
+            if (pid == 0):
+                break
+            status = self.children.pop(pid, None)
+            if (status is None):
+                continue
+            os.close(status.pipe)
+            if (self.running and not status.retiring):
+                self.log.warn("Worker %d exited with status %d, restarting" % (pid, exit_status))
+                self.spawn_worker()
+
+    def check_health(self):
+        """Kill workers that have stopped sending heartbeats"""
+        now = time.time()
+        for status in self.children.values():
+            if (now - status.last_heartbeat > self.heartbeat_timeout):
+                self.log.warn("Worker %d missed heartbeats for %.1fs, killing" %
+                              (status.pid, now - status.last_heartbeat))
+                self.kill(status.pid, signal.SIGKILL)
+                status.last_heartbeat = now
+
+    def restart_workers(self):
+        """Start replacing each current worker with a new one, one at a time
+
+        The workers are replaced by step_restart(). A restart requested
+        while one is in progress replaces all the workers again, as
+        those already started may have the old graphs.
+        """
+        self.log.info("Graceful restart of %d workers" % (len(self.children)))
+        self.restart_queue = [pid for pid in sorted(self.children) if (not self.children[pid].retiring)]
+
+    def step_restart(self):
+        """Advance the replacement of the workers in self.restart_queue
+
+        A new worker is started, and when it has sent a heartbeat (so
+        is accepting connections) the old one is sent SIGTERM. The next
+        worker is replaced once the old one has exited. A new worker
+        that exits before it is ready is replaced by reap_workers(),
+        the old one is then stopped anyway.
+        """
+        if (self.replacing is not None):
+            (old_pid, new_pid) = self.replacing
+            old = self.children.get(old_pid)
+            if (old is not None):
+                new = self.children.get(new_pid)
+                if (not old.retiring and (new is None or new.ready)):
+                    old.retiring = True
+                    self.kill(old_pid, signal.SIGTERM)
+                return
+            self.replacing = None
+        while (self.restart_queue):
+            old_pid = self.restart_queue.pop(0)
+            if (old_pid in self.children):
+                self.replacing = (old_pid, self.spawn_worker())
+                return
+
+    def stop_workers(self):
+        """Ask all workers to stop and wait for them"""
+        for pid in list(self.children):
+            self.children[pid].retiring = True
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.shutdown_grace + 1.0
+        while (self.children and time.time() < deadline):
+            self.reap_workers()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            self.kill(pid, signal.SIGKILL)
+        self.socket.close()
+
+    def kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            pass
+
+    def health(self):
+        """Return list of health information dicts, one per worker"""
+        return([self.children[pid].as_dict() for pid in sorted(self.children)])
+
+    def report(self):
+        """Log health report for all workers"""
+        for h in self.health():
+            self.log.warn("worker %(pid)d: uptime %(uptime)ss, last heartbeat %(last_heartbeat)ss ago, "
+                          "%(requests)d requests, %(active)d active" % h)
+
+    def write_status(self):
+        """Write health of workers as JSON to status_file, if set"""
+        if (not self.status_file):
+            return
+        tmp = self.status_file + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({'pid': os.getpid(),
+                       'address': "%s:%d" % self.server_address,
+                       'workers': self.health()}, fh, indent=2)
+        os.rename(tmp, self.status_file)
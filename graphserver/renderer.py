@@ -0,0 +1,367 @@
+"""Rendering of graphserver pages and resources
+
+The content served for each resource depends only on the Graph
+it belongs to, so rendering is separated from request handling
+in order that it can be done once when the server starts.
+
+Simeon Warner, 2015
+"""
+
+import cgi
+import urllib
+import urlparse
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+class NotFound(Exception):
+    pass
+
+def coalesce(pieces, size=65536):
+    """Generator joining strings from pieces into chunks of about size
+
+    Used so that content generated in small pieces is sent, or
+    hashed, in a few large chunks.
+    """
+    chunk = []
+    length = 0
+    for piece in pieces:
+        chunk.append(piece)
+        length += len(piece)
+        if (length >= size):
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+    if (chunk):
+        yield ''.join(chunk)
+
+class SvgLinker(object):
+
+    """Streaming rewrite of SVG from dot to link nodes to resources
+
+    Each <g class="node"> group with a <title> that is the name of a
+    node in graph is wrapped in <a xlink:href="/GRAPH/node">. Everything
+    else is written as parsed, in order, including comments and the
+    DOCTYPE. Feed the SVG to self.parser and take() the output so far.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.out = []
+        self.depth = 0
+        self.open_tag = False #last start tag not yet closed
+        self.mark = None #index in self.out of current node group
+        self.node_depth = None #depth of current node group
+        self.title = None #list of title text, while in title of node group
+        self.anchors = set() #depths of node groups wrapped in <a>
+        p = expat.ParserCreate()
+        p.returns_unicode = False
+        p.ordered_attributes = True
+        p.XmlDeclHandler = self.xml_decl
+        p.StartDoctypeDeclHandler = self.start_doctype
+        p.StartElementHandler = self.start_element
+        p.EndElementHandler = self.end_element
+        p.CharacterDataHandler = self.characters
+        p.CommentHandler = self.comment
+        self.parser = p
+
+    def take(self):
+        """Return output so far, except an unfinished node group"""
+        if (self.mark is not None):
+            return('')
+        chunk = ''.join(self.out)
+        self.out = []
+        return(chunk)
+
+    def close_tag(self):
+        if (self.open_tag):
+            self.out.append('>')
+            self.open_tag = False
+
+    def xml_decl(self, version, encoding, standalone):
+        self.out.append('<?xml version="%s" encoding="UTF-8"%s?>\n' %
+                        (version, {0: ' standalone="no"', 1: ' standalone="yes"'}.get(standalone, '')))
+
+    def start_doctype(self, name, system_id, public_id, has_internal_subset):
+        if (public_id):
+            self.out.append('<!DOCTYPE %s PUBLIC "%s"\n "%s">\n' % (name, public_id, system_id))
+        elif (system_id):
+            self.out.append('<!DOCTYPE %s SYSTEM "%s">\n' % (name, system_id))
+
+    def comment(self, data):
+        self.close_tag()
+        self.out.append('<!--%s-->' % (data))
+        if (self.depth == 0):
+            self.out.append('\n')
+
+    def start_element(self, name, attrs):
+        self.close_tag()
+        self.depth += 1
+        attrs = zip(attrs[::2], attrs[1::2])
+        if (name == 'g' and self.mark is None and ('class', 'node') in attrs):
+            self.mark = len(self.out)
+            self.node_depth = self.depth
+        elif (name == 'title' and self.mark is not None and self.depth == self.node_depth + 1):
+            self.title = []
+        self.out.append('<' + name + ''.join(' %s=%s' % (k, quote_attr(v)) for (k, v) in attrs))
+        self.open_tag = True
+
+    def end_element(self, name):
+        if (self.open_tag):
+            self.out.append('/>')
+            self.open_tag = False
+        else:
+            self.out.append('</%s>' % (name))
+        if (self.title is not None):
+            node_name = self.graph.normalize_name(''.join(self.title))
+            self.title = None
+            if (node_name in self.graph.nodes):
+                href = '/%s/%s' % (self.graph.name, node_name)
+                self.out.insert(self.mark, '<a xlink:href=%s>\n' % (quote_attr(href)))
+                self.anchors.add(self.node_depth)
+        elif (self.depth == self.node_depth):
+            if (self.depth in self.anchors):
+                self.anchors.discard(self.depth)
+                self.out.append('\n</a>')
+            self.mark = None
+            self.node_depth = None
+        self.depth -= 1
+
+    def characters(self, data):
+        self.close_tag()
+        if (self.title is not None):
+            self.title.append(data)
+        self.out.append(escape(data))
+
+def quote_attr(value):
+    """Return value escaped and quoted for use as an XML attribute"""
+    return('"%s"' % escape(value, {'"': '&quot;', '\n': '&#10;'}))
+
+class Renderer(object):
+
+    """Render index pages, node resources and SVG images for graphs
+
+    All methods return content strings (or lists of headers) and do
+    not depend on any request state other than the path of the
+    resource being rendered, which is used to build absolute URIs.
+    The pages that may be large for large graphs also have a *_chunks()
+    method that generates the content in chunks, so that it can be
+    built in linear time and sent without being held in memory.
+    """
+
+    def __init__(self, base_uri="http://unknown_base_uri/"):
+        self.base_uri = base_uri
+
+    def index_page(self, graphs, names=None, nav=''):
+        """Return content for top-level index page
+
+        names is the list of names of the graphs to include, in order,
+        the default is all graphs sorted by name. nav is HTML for
+        navigation between pages of the index, see index_nav().
+        """
+        return(''.join(self.index_page_chunks(graphs, names, nav)))
+
+    def index_page_chunks(self, graphs, names=None, nav='', sections=None):
+        """Generator of content for top-level index page in chunks
+
+        If sections is given it is a dict of the index_section() for
+        some graphs, keyed by graph name, which are used rather than
+        being rendered again.
+        """
+        return(coalesce(self.index_page_pieces(graphs, names, nav, sections)))
+
+    def index_page_pieces(self, graphs, names=None, nav='', sections=None):
+        yield "<html>\n<head>\n"
+        yield "<title>Signposting test server</title>\n"
+        yield '<link rel="stylesheet" href="/css/graphserver.css">\n</head>\n'
+        yield "<body>\n<h1>Signposting test server</h1>\n\n"
+        yield nav
+        for graph_name in (names if (names is not None) else sorted(graphs)):
+            if (sections is not None and graph_name in sections):
+                yield sections[graph_name]
+            else:
+                yield self.index_section(graphs[graph_name])
+        yield nav
+        yield "</body>\n</html>\n"
+
+    def index_section(self, graph):
+        """Return the part of the top-level index page for graph
+        """
+        egn = cgi.escape(graph.name)
+        content = ['<h3><a href="/%s/">Scenario: %s</a></h3>\n\n' % (egn,egn)]
+        if (graph.svg):
+            content.append("<a href=\"/%s/svg\"/>svg</a>\n" % (egn))
+        content.append('<ul>\n')
+        for node_name in graph.sorted_node_names():
+            enn = cgi.escape(graph.nodes[node_name].name)
+            content.append("<li><a href=\"/%s/%s\">%s</a></li>\n" % (egn,enn,enn))
+        content.append("</ul>\n\n")
+        return(''.join(content))
+
+    def index_nav(self, q, page, pages, per_page, total):
+        """Return HTML navigation for page of pages of the top-level index
+
+        The links keep the filter q and per_page of the current page,
+        total is the number of graphs matching q.
+        """
+        def link(page):
+            params = [('page', page), ('per_page', per_page)]
+            if (q):
+                params.insert(0, ('q', q))
+            return(cgi.escape('/?' + urllib.urlencode(params), quote=True))
+        first = min(total, (page-1)*per_page + 1)
+        last = min(total, page*per_page)
+        content = ['<p class="nav">Scenarios %d-%d of %d' % (first,last,total)]
+        if (q):
+            content.append(' matching "%s"' % (cgi.escape(q)))
+        content.append(', page %d of %d' % (page,pages))
+        if (page > 1):
+            content.append(' <a href="%s">previous</a>' % (link(page-1)))
+        if (page < pages):
+            content.append(' <a href="%s">next</a>' % (link(page+1)))
+        content.append("</p>\n\n")
+        return(''.join(content))
+
+    def graph_index_page(self, graph):
+        """Return content for index page of one graph
+        """
+        return(''.join(self.graph_index_page_chunks(graph)))
+
+    def graph_index_page_chunks(self, graph):
+        """Generator of content for index page of one graph in chunks"""
+        return(coalesce(self.graph_index_page_pieces(graph)))
+
+    def graph_index_page_pieces(self, graph):
+        yield "<html>\n<head>\n"
+        yield "<title>Signposting test server - %s</title>\n" % (graph.name)
+        yield '<link rel="stylesheet" href="/css/graphserver.css">\n</head>\n'
+        egn = cgi.escape(graph.name)
+        yield '<body>\n<h1>Scenario: %s</h1>\n\n' % (egn)
+        if (graph.svg):
+            yield '<object type="image/svg+xml" data="/%s/svg">Your browser does not support SVG</object>\n' % (graph.name)
+        yield '<ul>\n'
+        for node_name in graph.sorted_node_names():
+            enn = cgi.escape(graph.nodes[node_name].name)
+            yield "<li><a href=\"/%s/%s\">%s</a></li>\n" % (egn,enn,enn)
+        yield "</ul>\n\n"
+        yield "</body>\n</html>\n"
+
+    def node_content(self, graph, node):
+        """Return content for resource node in graph
+
+        Content for image and PDF nodes is not rendered, it comes from
+        the graphserver.assets.AssetStore.
+        """
+        if (node.mime_type == 'text/html'):
+            content = ["<html>\n<head>\n<title>%s</title>\n" % (node.name),
+                       '<link rel="stylesheet" href="/css/graphserver.css">\n</head>\n',
+                       "<body>\n<h1>%s</h1>\n" % (node.name),
+                       self.node_html_links_imgs(node),
+                       "<pre>\n", self.node_info(node), "</pre>\n"]
+            # Any fragments to deal with?
+            for (frag, frag_name, warnings) in graph.fragments.get(node.name, []):
+                frag_node = graph.nodes[frag_name]
+                content += ["<h2><a id=\"%s\">Fragment #%s</a></h2>\n" % (frag,frag),
+                            self.node_html_links_imgs(frag_node),
+                            "<pre>\n", self.node_info(frag_node), "</pre>\n",
+                            self.fragment_warnings(warnings)]
+            content.append("</body></html>\n")
+            return(''.join(content))
+        elif (node.mime_type=='text/turtle'):
+            return(self.build_turtle(node))
+        else: #assume text/plain
+            return(self.node_info(node))
+
+    def node_link_headers(self, node, path):
+        """Return list of Link headers for node at path
+        """
+        headers = []
+        for link in node.links:
+            (rel,dst,mime_type)=link
+            uri = self.full_uri(path, dst)
+            mime_type_str = ('; type="%s"' % (mime_type)) if (mime_type) else ''
+            headers.append(['Link','<%s>; rel="%s"%s' % (uri,rel,mime_type_str)])
+        return(headers)
+
+    def node_info(self, node):
+        """Return preformatted node information string"""
+        return("name: %s\n" % node.name +
+               "mime_type: %s\n" % str(node.mime_type) +
+               "conneg: %s\n" % str(node.conneg) +
+               "links: %s\n" % str(node.links))
+
+    def node_html_links_imgs(self, node):
+        """Return HTML for included links and imgs"""
+        return( self.node_html_links(node) + self.node_html_imgs(node) )
+
+    def node_html_imgs(self, node):
+        """Return HTML <ul> list of img links for this node"""
+        html = ''.join("<li><a href=\"%s\">%s</a></li>\n" % (img,img) for img in node.html_imgs)
+        if (html):
+            return("<p>Images included:</p>\n<ul>\n"+html+"</ul>\n")
+        else:
+            return("")
+
+    def node_html_links(self, node):
+        """Return HTML <ul> list of HTML links for this node"""
+        html = ''.join("<li><a href=\"%s\">%s</a></li>\n" % (dst,dst) for dst in node.html_links)
+        if (html):
+            return("<p>Links to:</p>\n<ul>\n"+html+"</ul>\n")
+        else:
+            return("")
+
+    def fragment_warnings(self, warnings):
+        """Return HTML for warnings from Graph.check_fragment(), blank if none
+        """
+        if (warnings):
+            return "<p class=\"error\">WARNINGS:<br/>" + "<br/>\n".join(warnings) + "</p>\n"
+        else:
+            return ""
+
+    def read_and_link_svg(self, file, graph):
+        """ Read SVG and mark up all nodes as links to resources in graph
+
+        Each node group in the svg output from dot is wrapped in a link
+        to the resource, see SvgLinker. Raises NotFound if the file
+        cannot be read or is not well-formed XML.
+        """
+        return(''.join(self.read_and_link_svg_chunks(file, graph)))
+
+    def read_and_link_svg_chunks(self, file, graph):
+        """Generator of linked SVG in chunks, see read_and_link_svg()
+
+        The file is parsed in blocks as the chunks are generated.
+        """
+        try:
+            f = open(file,'rb')
+        except Exception as e:
+            raise NotFound("read_and_link_svg: Failed: %s" % (str(e)))
+        linker = SvgLinker(graph)
+        with f:
+            while True:
+                data = f.read(65536)
+                try:
+                    linker.parser.Parse(data, not data)
+                except expat.ExpatError as e:
+                    raise NotFound("read_and_link_svg: Failed to parse %s: %s" % (file, str(e)))
+                chunk = linker.take()
+                if (chunk):
+                    yield chunk
+                if (not data):
+                    break
+
+    def build_turtle(self, node):
+        """Return a turtle description of this node
+
+        Just a dummy version of the node info for amusement
+        """
+        return("@prefix dc: <http://purl.org/dc/elements/1.1/> .\n" +
+               "@prefix x: <http://example.org/terms/> .\n\n" +
+               '[ dc:title    "%s" ;\n' % node.name +
+               '  x:mime_type "%s" ;\n' % str(node.mime_type) +
+               '  x:conneg    "%s" ;\n' % str(node.conneg) +
+               '  x:links     "%s" ;\n' % str(node.links) +
+               "] .\n")
+
+    def full_uri(self, path, relative_uri):
+        """Return full URI for relative_uri in the context of path"""
+        return urlparse.urljoin(self.base_uri+path, relative_uri)
@@ -0,0 +1,584 @@
+"""Precompiled responses for all resources of a set of graphs
+
+The graphs do not change after they have been parsed so every
+response that graphserver can send is rendered once, when the
+cache is compiled, and then served by lookup on the request path.
+
+Simeon Warner, 2015
+"""
+
+import email.utils
+import hashlib
+import json
+import logging
+import os.path
+import threading
+import time
+import urlparse
+import zlib
+from collections import OrderedDict
+from negotiator import ContentNegotiator, AcceptParameters, ContentType
+from graphserver.assets import AssetStore
+from graphserver.renderer import Renderer, NotFound
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def gzip_chunks(chunks):
+    """Return content of string chunks compressed in gzip format"""
+    return(''.join(gzip_stream(chunks, 9)))
+
+def gzip_stream(chunks, level=6):
+    """Generator of content of string chunks compressed in gzip format
+
+    The output depends only on the content and level (there is no
+    timestamp in the gzip header) so the ETag of compressed content
+    is the same each time it is generated.
+    """
+    z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = z.compress(chunk)
+        if (data):
+            yield data
+    yield z.flush()
+
+def gunzip_chunks(data, size=65536):
+    """Generator of content of gzip data in chunks of up to size"""
+    z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for start in xrange(0, len(data), size):
+        chunk = z.decompress(data[start:start+size])
+        if (chunk):
+            yield chunk
+    chunk = z.flush()
+    if (chunk):
+        yield chunk
+
+class Response(object):
+
+    """An immutable pre-rendered HTTP response
+
+    Has a status code, a list of [name, value] headers, the encoded
+    body and an ETag computed from the body. The headers are also
+    pre-encoded (together with Content-Length) so that they can be
+    written in a single operation.
+
+    The content may instead be a StaticAsset. Small assets are used
+    as the body, large ones are kept in self.asset and must be sent
+    with StaticAsset.send_to().
+
+    Or the content may be generated by stream, a callable that returns
+    an iterable of string chunks, for content too large to keep in
+    memory. It is generated once to compute the ETag and then again
+    for each request, and is sent without Content-Length.
+
+    The validators, ETag and Last-Modified from mtime (the time the
+    source of the response was modified), are pre-encoded separately
+    in self.validators. The head of a 304 Not Modified response, the
+    validators and those of the headers in NOT_MODIFIED_HEADERS such
+    as Vary, is pre-encoded in self.not_modified_head.
+
+    If there are compressed variants of the content then self.encoded
+    is a dict of them keyed by content coding ('gzip' or 'br'), each
+    a Response with a Content-Encoding header, else it is None.
+    """
+
+    __slots__ = ('code', 'headers', 'body', 'asset', 'stream', 'length', 'etag',
+                 'mtime', 'validators', 'not_modified_head', 'head', 'encoded')
+
+    # Headers that a 304 response must repeat from the 200 (RFC 7232 4.1)
+    NOT_MODIFIED_HEADERS = ('Cache-Control', 'Content-Location', 'Expires', 'Vary')
+
+    def __init__(self, code=200, headers=None, body='', asset=None, mtime=None, stream=None,
+                 encoded=None):
+        if (isinstance(body, unicode)):
+            body = body.encode('utf-8')
+        headers = tuple(tuple(h) for h in (headers or []))
+        if (stream is not None):
+            h = hashlib.sha1()
+            length = 0
+            for chunk in stream():
+                h.update(chunk)
+                length += len(chunk)
+            etag = '"%s"' % h.hexdigest()
+        elif (asset is not None):
+            etag = asset.etag
+            length = asset.size
+            if (asset.data is not None):
+                body = asset.data
+                asset = None
+        else:
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            length = len(body)
+        object.__setattr__(self, 'code', code)
+        object.__setattr__(self, 'headers', headers)
+        object.__setattr__(self, 'body', body)
+        object.__setattr__(self, 'asset', asset)
+        object.__setattr__(self, 'stream', stream)
+        object.__setattr__(self, 'encoded', encoded)
+        object.__setattr__(self, 'length', length)
+        object.__setattr__(self, 'etag', etag)
+        if (mtime is None):
+            mtime = time.time()
+        object.__setattr__(self, 'mtime', int(mtime))
+        validators = "ETag: %s\r\nLast-Modified: %s\r\n" % (etag, email.utils.formatdate(mtime, usegmt=True))
+        object.__setattr__(self, 'validators', validators)
+        object.__setattr__(self, 'not_modified_head',
+                           ''.join("%s: %s\r\n" % (name, value) for (name, value) in headers
+                                   if (name in self.NOT_MODIFIED_HEADERS)) + validators)
+        head = ''.join("%s: %s\r\n" % (name, value) for (name, value) in headers)
+        if (stream is None):
+            head += "Content-Length: %d\r\n" % length
+        head += validators
+        object.__setattr__(self, 'head', head)
+
+    def not_modified(self, if_none_match=None, if_modified_since=None):
+        """True if conditional request headers show client copy is current
+
+        If-None-Match takes precedence over If-Modified-Since, and
+        only 200 responses are subject to conditions.
+        """
+        if (self.code != 200):
+            return(False)
+        if (if_none_match is not None):
+            for etag in if_none_match.split(','):
+                etag = etag.strip()
+                if (etag.startswith('W/')):
+                    etag = etag[2:]
+                if (etag == '*' or etag == self.etag):
+                    return(True)
+            return(False)
+        if (if_modified_since is not None):
+            t = email.utils.parsedate_tz(if_modified_since)
+            if (t is not None):
+                return(self.mtime <= email.utils.mktime_tz(t))
+        return(False)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Response is immutable")
+
+    def __repr__(self):
+        return "Response(%d, %s, %d bytes)" % (self.code, str(self.headers), self.length)
+
+class LRUCache(object):
+
+    """Bounded, thread-safe least-recently-used cache with hit/miss counters"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return value for key, None if not present"""
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return(None)
+            self.data[key] = value
+            self.hits += 1
+            return(value)
+
+    def put(self, key, value):
+        """Add value for key, discarding least recently used if full"""
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            if (len(self.data) > self.maxsize):
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return(len(self.data))
+
+class ConnegResource(object):
+
+    """Compiled node with conneg rules
+
+    Has the Response for each conneg content type in variants (plus
+    the Response used when there is no Accept header under the key
+    None) and a ContentNegotiator built from the node's conneg rules.
+    """
+
+    def __init__(self, node, path, variants):
+        self.node = node
+        self.path = path
+        self.variants = variants
+        # Configure conneg and work out default from node config
+        acceptable=[]
+        default_content_type=None
+        for (content_type, (code,dst,default)) in node.conneg.items():
+            acceptable.append(AcceptParameters(ContentType(content_type)))
+            if (default):
+                default_content_type=content_type
+        # If there was no default, pick the last one we saw
+        if (not default_content_type):
+            default_content_type=content_type
+        self.default_content_type = default_content_type
+        default_params = AcceptParameters(ContentType(default_content_type))
+        self.negotiator = ContentNegotiator(default_params, acceptable)
+
+    def negotiate(self, accept):
+        """Return conneg content type selected for Accept header accept"""
+        selected = self.negotiator.negotiate(accept)
+        if (selected is not None and
+            str(selected.content_type) in self.variants):
+            return(str(selected.content_type))
+        return(self.default_content_type)
+
+class ResponseCache(object):
+
+    """Responses for every path of a set of graphs, keyed by path
+
+    Paths are normalized request paths, e.g. '/', '/GRAPH' or
+    '/GRAPH/node'. Nodes with conneg rules are ConnegResource objects
+    in self.conneg[path], and the results of negotiation are kept in
+    the LRUCache self.negotiated keyed by (path, Accept header).
+
+    The link structure of each graph is at '/GRAPH/_paths' and what
+    can be reached from each node at '/GRAPH/_paths/node'. The latter
+    are built on first request, as there are as many as nodes and
+    each may be as large as the graph, and kept in the LRUCache
+    self.node_paths.
+
+    The SVG image of each graph, with nodes linked to resources, is
+    built once and kept gzip compressed in self.svg_gzip by graph name.
+    The response for '/GRAPH/svg' is the content when it is small and
+    otherwise is streamed from the compressed copy, which is sent as
+    is to clients that accept gzip.
+
+    Responses with content of the compress_types of at least
+    compress_min_size bytes have gzip (and, if the brotli module is
+    available, br) variants compressed when they are compiled, see
+    response() and select_encoding().
+
+    The index at '/' lists every graph. The part for each graph is kept
+    in self.index_sections so that it is rendered again only when the
+    graph changes. Pages of the index selected by query parameters (see
+    lookup_index()) are kept in the LRUCache self.index_pages.
+    """
+
+    conneg_cache_size = 1024
+    max_body_size = 1024*1024
+    paths_cache_size = 256
+    index_per_page = 50
+    index_max_per_page = 1000
+    index_cache_size = 128
+    compress_types = ('text/', 'application/json', 'image/svg+xml')
+    compress_min_size = 256
+    encodings = ('br', 'gzip') if (brotli is not None) else ('gzip',)
+
+    def __init__(self, graphs=None, base_uri="http://unknown_base_uri/", assets=None):
+        self.graphs = graphs if (graphs is not None) else {}
+        self.renderer = Renderer(base_uri)
+        self.assets = assets if (assets is not None) else AssetStore()
+        self.responses = {}
+        self.conneg = {}
+        self.negotiated = LRUCache(self.conneg_cache_size)
+        self.accepted = LRUCache(self.conneg_cache_size)
+        self.node_paths = LRUCache(self.paths_cache_size)
+        self.index_pages = LRUCache(self.index_cache_size)
+        self.index_sections = {}
+        self.index_mtime = None
+        self.graph_paths = {}
+        self.svg_gzip = {}
+        self.compile_seconds = {}
+        self.log = logging.getLogger('response_cache')
+
+    def compile(self, static_files=('/css/graphserver.css',), previous=None, changed=()):
+        """Render responses for all graphs, return number of responses
+
+        If previous (a ResponseCache for an earlier set of graphs) is
+        given then the responses for graphs not named in changed are
+        reused from it rather than rendered again.
+        """
+        self.responses = {}
+        self.conneg = {}
+        self.graph_paths = {}
+        self.svg_gzip = {}
+        self.compile_seconds = {}
+        self.negotiated.clear()
+        self.node_paths.clear()
+        self.index_pages.clear()
+        self.index_sections = {}
+        for path in static_files:
+            try:
+                asset = self.assets.get('.'+path)
+                self.responses[path] = Response(asset=asset, mtime=asset.mtime)
+            except (IOError, OSError) as e:
+                self.log.warn("Failed to load static file: %s" % (str(e)))
+        for graph_name in self.graphs:
+            if (previous is not None and graph_name not in changed and
+                graph_name in previous.graph_paths):
+                self.reuse_graph(previous, graph_name)
+            else:
+                start = time.time()
+                self.compile_graph(self.graphs[graph_name])
+                self.compile_seconds[graph_name] = time.time() - start
+        mtimes = [g.mtime for g in self.graphs.values() if g.mtime is not None]
+        self.index_mtime = max(mtimes) if mtimes else None
+        (graphs, sections) = (self.graphs, self.index_sections)
+        self.responses['/'] = self.page_response(lambda: self.renderer.index_page_chunks(graphs, sections=sections),
+                                                 self.index_mtime, [['Content-Type', 'text/html']])
+        num = len(self.responses) + sum(len(r.variants) for r in self.conneg.values())
+        self.log.info("Compiled %d responses for %d graphs" % (num, len(self.graphs)))
+        return(num)
+
+    def compile_graph(self, graph):
+        """Render responses for index, SVG and all nodes of graph
+        """
+        graph_path = '/' + graph.name
+        self.index_sections[graph.name] = self.renderer.index_section(graph)
+        self.responses[graph_path] = self.page_response(lambda: self.renderer.graph_index_page_chunks(graph),
+                                                        graph.mtime, [['Content-Type', 'text/html']])
+        for node_name in graph.nodes:
+            path = graph_path + '/' + node_name
+            self.compile_node(graph, graph.nodes[node_name], path)
+        svg_path = graph_path + '/svg'
+        if (graph.svg and svg_path not in self.responses):
+            try:
+                mtime = max(graph.mtime, os.path.getmtime(graph.svg))
+                svg_gzip = gzip_chunks(self.renderer.read_and_link_svg_chunks(graph.svg, graph))
+                self.svg_gzip[graph.name] = svg_gzip
+                self.responses[svg_path] = self.page_response(lambda: gunzip_chunks(svg_gzip), mtime,
+                                                              [['Content-Type', 'image/svg+xml']], svg_gzip)
+            except (NotFound, OSError) as e:
+                self.log.warn(str(e))
+        paths_path = graph_path + '/_paths'
+        self.add_json(paths_path, graph.paths_summary(), graph.mtime)
+        self.graph_paths[graph.name] = [p for p in [graph_path, svg_path] +
+                                        [graph_path + '/' + n for n in graph.nodes] +
+                                        [paths_path]
+                                        if (p in self.responses or p in self.conneg)]
+
+    def reuse_graph(self, previous, graph_name):
+        """Copy responses for graph_name from previous ResponseCache
+        """
+        self.graph_paths[graph_name] = previous.graph_paths[graph_name]
+        self.compile_seconds[graph_name] = previous.compile_seconds.get(graph_name)
+        if (graph_name in previous.svg_gzip):
+            self.svg_gzip[graph_name] = previous.svg_gzip[graph_name]
+        self.index_sections[graph_name] = previous.index_sections[graph_name]
+        for path in self.graph_paths[graph_name]:
+            if (path in previous.conneg):
+                self.conneg[path] = previous.conneg[path]
+            else:
+                self.responses[path] = previous.responses[path]
+
+    def page_response(self, chunks, mtime=None, headers=None, gzip_data=None):
+        """Return Response with headers for page content generated by chunks()
+
+        Content up to max_body_size is joined into the body, larger
+        content is streamed, generated again by chunks() for each
+        request (see Response). gzip_data is passed to response().
+        """
+        content = []
+        length = 0
+        for chunk in chunks():
+            content.append(chunk)
+            length += len(chunk)
+            if (length > self.max_body_size):
+                return(self.response(200, headers, mtime=mtime, stream=chunks, gzip_data=gzip_data))
+        return(self.response(200, headers, ''.join(content), mtime=mtime, gzip_data=gzip_data))
+
+    def response(self, code=200, headers=None, body='', asset=None, mtime=None, stream=None,
+                 gzip_data=None):
+        """Return Response, with compressed variants if the content is compressible
+
+        The arguments are as for Response. Compressible content is that
+        of 200 responses with a Content-Type in compress_types and either
+        streamed or at least compress_min_size bytes. Variants that are
+        not smaller are dropped, and if any are kept all the responses
+        have Vary: Accept-Encoding. gzip_data, if given, is the content
+        already gzip compressed. Compressed variants of streamed content
+        are streamed, compressed as they are sent, unless gzip_data is
+        given.
+        """
+        headers = [list(h) for h in (headers or [])]
+        if (isinstance(body, unicode)):
+            body = body.encode('utf-8')
+        content_type = dict(headers).get('Content-Type', '')
+        if (code != 200 or asset is not None or not content_type.startswith(self.compress_types) or
+            (stream is None and len(body) < self.compress_min_size)):
+            return(Response(code, headers, body, asset, mtime, stream))
+        plain_headers = headers
+        headers = self.add_vary(headers, 'Accept-Encoding')
+        encoded = {}
+        if (stream is not None and gzip_data is None):
+            encoded['gzip'] = Response(code, headers + [['Content-Encoding', 'gzip']], mtime=mtime,
+                                       stream=lambda: gzip_stream(stream()))
+        else:
+            data = {'gzip': gzip_data if (gzip_data is not None) else gzip_chunks([body])}
+            if (brotli is not None and stream is None):
+                data['br'] = brotli.compress(body)
+            for (encoding, data) in data.items():
+                if (stream is not None or len(data) < len(body)):
+                    encoded[encoding] = Response(code, headers + [['Content-Encoding', encoding]],
+                                                 data, mtime=mtime)
+        if (not encoded):
+            return(Response(code, plain_headers, body, asset, mtime, stream))
+        return(Response(code, headers, body, asset, mtime, stream, encoded))
+
+    def add_vary(self, headers, name):
+        """Return copy of headers with name added to the Vary header"""
+        for (n, (header, value)) in enumerate(headers):
+            if (header == 'Vary'):
+                return(headers[:n] + [['Vary', value + ', ' + name]] + headers[n+1:])
+        return(headers + [['Vary', name]])
+
+    def add_json(self, path, data, mtime=None):
+        """Add response at path with data serialized as JSON"""
+        self.responses[path] = self.json_response(data, mtime)
+
+    def json_response(self, data, mtime=None):
+        """Return Response with data serialized as JSON"""
+        return(self.response(200, [['Content-Type', 'application/json']],
+                             json.dumps(data, indent=2, sort_keys=True) + "\n", mtime=mtime))
+
+    def compile_node(self, graph, node, path):
+        """Render response, or conneg responses, for node at path
+
+        Nodes with a MIME type that has a file in the AssetStore (images
+        and PDFs) have that file as content. If the file cannot be read
+        there is no response for the node.
+        """
+        headers = []
+        if (node.mime_type):
+            headers.append(['Content-Type',node.mime_type])
+        body = ''
+        try:
+            asset = self.assets.for_type(node.mime_type)
+        except (IOError, OSError) as e:
+            self.log.warn("No content for %s: %s" % (path, str(e)))
+            return
+        mtime = graph.mtime
+        if (asset is None):
+            body = self.renderer.node_content(graph, node)
+        else:
+            mtime = max(mtime, asset.mtime)
+        link_headers = self.renderer.node_link_headers(node, path)
+        if (not node.conneg):
+            self.responses[path] = self.response(200, headers + link_headers, body, asset, mtime)
+            return
+        headers.append(['Vary', 'Accept'])
+        variants = {}
+        variants[None] = self.response(200, headers + link_headers, body, asset, mtime)
+        for (content_type, (code,dst,default)) in node.conneg.items():
+            self.log.info("%s conneg: config %s (%d,%s,%s)" % (path,content_type,code,dst,default))
+            location = ['Location', self.renderer.full_uri(path, dst)]
+            variants[content_type] = Response(code, headers + [location] + link_headers, body, asset, mtime)
+        self.conneg[path] = ConnegResource(node, path, variants)
+
+    def normalize_accept(self, accept):
+        """Normalize Accept header for use as cache key, removes whitespace"""
+        return(''.join(accept.split()))
+
+    def select_encoding(self, response, accept_encoding=None):
+        """Return compressed variant of response, if any, for Accept-Encoding header
+
+        With no Accept-Encoding header (accept_encoding None), or if
+        none of the encodings accepted is available, response is returned.
+        """
+        if (response.encoded is None or accept_encoding is None):
+            return(response)
+        for encoding in self.accepted_encodings(accept_encoding):
+            if (encoding in response.encoded):
+                return(response.encoded[encoding])
+        return(response)
+
+    def accepted_encodings(self, accept_encoding):
+        """Return list of self.encodings accepted by Accept-Encoding header
+
+        In order of preference: highest q value first and then in the
+        order of self.encodings. Memoized in self.accepted.
+        """
+        encodings = self.accepted.get(accept_encoding)
+        if (encodings is not None):
+            return(encodings)
+        qvalues = {}
+        for item in accept_encoding.lower().split(','):
+            params = item.split(';')
+            q = 1.0
+            for param in params[1:]:
+                (name, sep, value) = param.partition('=')
+                if (name.strip() == 'q'):
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            qvalues[params[0].strip()] = q
+        if ('x-gzip' in qvalues):
+            qvalues.setdefault('gzip', qvalues['x-gzip'])
+        star = qvalues.get('*', 0.0)
+        encodings = [e for e in self.encodings if (qvalues.get(e, star) > 0.0)]
+        encodings.sort(key=lambda e: -qvalues.get(e, star))
+        self.accepted.put(accept_encoding, encodings)
+        return(encodings)
+
+    def lookup(self, path):
+        """Return Response for path, raise NotFound if there is none
+
+        Paths of conneg nodes are not included, see self.conneg.
+        """
+        try:
+            return(self.responses[path])
+        except KeyError:
+            return(self.lookup_node_paths(path))
+
+    def lookup_index(self, query):
+        """Return Response for the top-level index with query string query
+
+        The query parameters are q, to list only graphs with names that
+        contain q (ignoring case), and page and per_page to select one
+        page of the graphs, sorted by name. Built on first request, raises
+        NotFound for bad parameters or a page past the last.
+        """
+        params = urlparse.parse_qs(query)
+        q = params.get('q', [''])[0].strip()
+        try:
+            page = int(params.get('page', ['1'])[0])
+            per_page = int(params.get('per_page', [self.index_per_page])[0])
+        except ValueError:
+            raise NotFound
+        per_page = min(max(per_page, 1), self.index_max_per_page)
+        key = (q.lower(), page, per_page)
+        response = self.index_pages.get(key)
+        if (response is not None):
+            return(response)
+        names = [n for n in sorted(self.graphs) if q.lower() in n.lower()]
+        pages = max(1, (len(names) + per_page - 1) // per_page)
+        if (page < 1 or page > pages):
+            raise NotFound
+        nav = self.renderer.index_nav(q, page, pages, per_page, len(names))
+        names = names[(page-1)*per_page:page*per_page]
+        (graphs, sections) = (self.graphs, self.index_sections)
+        response = self.page_response(lambda: self.renderer.index_page_chunks(graphs, names, nav, sections),
+                                      self.index_mtime, [['Content-Type', 'text/html']])
+        self.index_pages.put(key, response)
+        return(response)
+
+    def lookup_node_paths(self, path):
+        """Return Response for '/GRAPH/_paths/node'
+
+        Built on first request, raises NotFound if path is not of that
+        form or the graph or node does not exist.
+        """
+        parts = path.split('/', 3)
+        if (len(parts) != 4 or parts[2] != '_paths' or parts[1] not in self.graphs):
+            raise NotFound
+        response = self.node_paths.get(path)
+        if (response is not None):
+            return(response)
+        graph = self.graphs[parts[1]]
+        if (parts[3] not in graph.nodes):
+            raise NotFound
+        response = self.json_response(graph.paths_from(parts[3]), graph.mtime)
+        self.node_paths.put(path, response)
+        return(response)
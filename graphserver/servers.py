@@ -0,0 +1,246 @@
+"""Server classes for the graphserver concurrency modes
+
+All modes use the same request handler class (GSHTTPRequestHandler)
+so routing and responses are identical whichever is selected:
+
+  single    one request at a time (BaseHTTPServer.HTTPServer)
+  threads   a thread per connection, or a fixed pool of worker threads
+  async     single-threaded event loop using asyncore, requests are
+            buffered and then handled by the usual handler class
+  prefork   pre-forked worker processes sharing the parsed graphs,
+            see graphserver.prefork
+
+Simeon Warner, 2015
+"""
+
+import asynchat
+import asyncore
+import BaseHTTPServer
+import multiprocessing
+import Queue
+import re
+import socket
+import SocketServer
+import threading
+from StringIO import StringIO
+from graphserver.prefork import PreforkHTTPServer
+
+MODES = ('single', 'threads', 'async', 'prefork')
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """HTTP server that handles each connection in a new thread"""
+
+    daemon_threads = True
+
+class PooledHTTPServer(BaseHTTPServer.HTTPServer):
+
+    """HTTP server that handles connections in a fixed pool of threads
+
+    Accepted connections are put on a queue that is serviced by
+    self.workers worker threads, which are started on the first call
+    to serve_forever().
+    """
+
+    workers = 8
+    request_queue_size = 128
+
+    def serve_forever(self, poll_interval=0.5):
+        self.requests = Queue.Queue()
+        for n in range(self.workers):
+            t = threading.Thread(target=self.process_request_worker,
+                                 name="worker-%d" % (n))
+            t.daemon = True
+            t.start()
+        BaseHTTPServer.HTTPServer.serve_forever(self, poll_interval)
+
+    def process_request(self, request, client_address):
+        """Queue request for the next free worker"""
+        self.requests.put((request, client_address))
+
+    def process_request_worker(self):
+        """Worker loop: take connections from queue and handle them"""
+        while True:
+            (request, client_address) = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+class ChunkBuffer(object):
+
+    """File-like list of output chunks, strings or asynchat producers"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        if (data):
+            self.chunks.append(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return(''.join(self.chunks))
+
+class ChunkProducer(object):
+
+    """asynchat producer for an iterable of strings or buffers
+
+    The chunks are only generated as the channel is ready to send.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def more(self):
+        try:
+            return(str(next(self.chunks)))
+        except StopIteration:
+            return('')
+
+class AssetProducer(ChunkProducer):
+
+    """asynchat producer for the content of a large StaticAsset"""
+
+    chunk_size = 65536
+
+    def __init__(self, asset):
+        ChunkProducer.__init__(self, asset.chunks(self.chunk_size))
+
+class BufferedRequestMixIn:
+
+    """Mix-in for a BaseHTTPRequestHandler to handle a buffered request
+
+    Instead of a socket, request is the complete data of one HTTP
+    request. The response is written to a ChunkBuffer self.wfile,
+    large static assets and streamed content are added as producers
+    so that they are not read into memory or generated in advance.
+    """
+
+    def setup(self):
+        self.rfile = StringIO(self.request)
+        self.wfile = ChunkBuffer()
+
+    def send_asset(self, asset):
+        self.wfile.chunks.append(AssetProducer(asset))
+
+    def send_chunks(self, chunks):
+        self.wfile.chunks.append(ChunkProducer(chunks))
+
+    def handle(self):
+        self.handle_one_request()
+
+    def finish(self):
+        pass
+
+class AsyncHTTPChannel(asynchat.async_chat):
+
+    """One client connection for AsyncHTTPServer
+
+    Collects request headers (and a body if Content-Length is given)
+    and then runs the server's handler class on the complete request.
+    Supports keep-alive and pipelined requests.
+    """
+
+    content_length_re = re.compile(r'^content-length:\s*(\d+)\s*$', re.I|re.M)
+    ac_out_buffer_size = 65536
+
+    def __init__(self, sock, client_address, server):
+        asynchat.async_chat.__init__(self, sock)
+        self.client_address = client_address
+        self.server = server
+        self.ibuffer = []
+        self.head = None
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        self.ibuffer.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self.ibuffer)
+        self.ibuffer = []
+        if (self.head is None):
+            head = data + '\r\n\r\n'
+            m = self.content_length_re.search(head)
+            if (m and int(m.group(1)) > 0):
+                # Wait for body before handling request
+                self.head = head
+                self.set_terminator(int(m.group(1)))
+                return
+            self.handle_request(head)
+        else:
+            head = self.head
+            self.head = None
+            self.set_terminator('\r\n\r\n')
+            self.handle_request(head + data)
+
+    def handle_request(self, data):
+        handler = self.server.RequestHandlerClass(data, self.client_address, self.server)
+        for chunk in handler.wfile.chunks:
+            if (isinstance(chunk, ChunkProducer)):
+                self.push_with_producer(chunk)
+            else:
+                self.push(chunk)
+        if (handler.close_connection):
+            self.close_when_done()
+
+class AsyncHTTPServer(asyncore.dispatcher):
+
+    """HTTP server using a single-threaded asyncore event loop
+
+    Has the same constructor and serve_forever() interface as
+    BaseHTTPServer.HTTPServer.
+    """
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, RequestHandlerClass):
+        asyncore.dispatcher.__init__(self)
+        class BufferedRequestHandler(BufferedRequestMixIn, RequestHandlerClass):
+            pass
+        self.RequestHandlerClass = BufferedRequestHandler
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(server_address)
+        self.listen(self.request_queue_size)
+        self.server_address = self.socket.getsockname()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if (pair is not None):
+            (sock, client_address) = pair
+            AsyncHTTPChannel(sock, client_address, self)
+
+    def serve_forever(self):
+        asyncore.loop(use_poll=True)
+
+def server_class(mode='single', workers=0, status_file=None):
+    """Return server class for mode, workers is size of thread pool
+
+    With mode 'threads' and workers=0 a new thread is used for each
+    connection, otherwise a pool of workers threads is used. With
+    mode 'prefork' workers is the number of processes (default one
+    per CPU) and status_file the file to write worker health to.
+    """
+    if (mode == 'single'):
+        return(BaseHTTPServer.HTTPServer)
+    elif (mode == 'threads'):
+        if (workers > 0):
+            class PooledServer(PooledHTTPServer):
+                pass
+            PooledServer.workers = workers
+            return(PooledServer)
+        return(ThreadingHTTPServer)
+    elif (mode == 'async'):
+        return(AsyncHTTPServer)
+    elif (mode == 'prefork'):
+        class PreforkServer(PreforkHTTPServer):
+            pass
+        PreforkServer.workers = workers if (workers > 0) else multiprocessing.cpu_count()
+        PreforkServer.status_file = status_file
+        return(PreforkServer)
+    raise ValueError("Unknown server mode %s, must be one of %s" % (mode, ', '.join(MODES)))